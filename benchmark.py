@@ -0,0 +1,33 @@
+"""
+Entry point for training throughput benchmark on a synthetic corpus. Results
+are saved to RESULTS_PATH. If path of results saved by another version of the
+code is given as an argument, speedups against them are printed as well.
+"""
+
+
+import sys
+
+from model.benchmarking import *
+
+
+RESULTS_PATH = "data/benchmark.json"
+
+
+def main():
+    results = run_benchmarks(DEFAULT_GRID, steps_count=50)
+    save_results(results, RESULTS_PATH)
+    for result in results:
+        print("{config}: {chars_per_second:.0f} chars/s, "
+              "build {graph_build_time:.2f} s, "
+              "peak rss {peak_rss_mb:.0f} MB".format(**result))
+        print("    " + ", ".join(
+            "{} {:.2f} ms".format(section, duration * 1000)
+            for section, duration in result["step_time"].items()
+        ))
+    if len(sys.argv) > 1:
+        for config, speedup in compare_results(sys.argv[1], results):
+            print("{}: {:.2f}x".format(config, speedup))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""
+Entry point for data parallel training scaling benchmark. It reports training
+sequences processed per second for growing numbers of worker processes.
+"""
+
+
+import os
+
+from model.parallel import measure_scaling
+from processing.dataset import Dataset
+
+
+ADDRESS = ("localhost", 8767)
+
+
+def main():
+    roll_out = 20
+    dataset_params = {"file_path": "data/dataset/tunes.csv",
+                      "filtering_params": {"tune_types": ["reel"]},
+                      "batch_size": 100, "roll_out": roll_out,
+                      "subsets_sizes": [0.7, 0.2, 0.1],
+                      "cache_root": "data/cache"}
+    charset_size = Dataset(**dataset_params).get_charset_size()
+    build_params = {"charset_size": charset_size, "roll_out": roll_out,
+                    "layers_count": 3, "layers_size": 256}
+    workers_counts = [1]
+    while workers_counts[-1] * 2 <= os.cpu_count():
+        workers_counts.append(workers_counts[-1] * 2)
+    scaling = measure_scaling(workers_counts, ADDRESS, dataset_params,
+                              build_params)
+    single_speed = scaling[0][1]
+    print("workers  samples/sec  speedup")
+    for workers_count, speed in scaling:
+        print("{:7d}  {:11.1f}  {:7.2f}".format(workers_count, speed,
+                                               speed / single_speed))
+
+
+if __name__ == "__main__":
+    main()
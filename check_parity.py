@@ -0,0 +1,34 @@
+"""
+Entry point for check of the model exported for numpy inference against the
+tensorflow graph, which doesn't write any files. Paths of the checkpoint, its
+.meta file, the exported weights and the codec can be given as arguments,
+otherwise the best model is checked. Exit status is nonzero, if lstm states
+or output logits of the models differ.
+"""
+
+
+import sys
+
+from model.composer import Composer
+from model.numpy_composer import NumpyComposer, check_parity
+
+
+DEFAULT_PATHS = ["data/best_model/model", "data/best_model/model.meta",
+                 "data/best_model/weights.npz", "data/best_model/codec.bin"]
+
+
+def main():
+    paths = sys.argv[1:] or DEFAULT_PATHS
+    if len(paths) != len(DEFAULT_PATHS):
+        sys.exit("Usage: check_parity.py [model meta weights codec]")
+    model_path, meta_path, weights_path, codec_path = paths
+    composer = Composer(model_path, meta_path, codec_path)
+    try:
+        check_parity(composer, NumpyComposer(weights_path, codec_path))
+    finally:
+        composer.close()
+    print("Numpy model matches the tensorflow graph.")
+
+
+if __name__ == "__main__":
+    main()
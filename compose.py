@@ -6,13 +6,14 @@ from model.composer import Composer
 
 def main():
     composer = Composer("data/best_model/model", "data/best_model/model.meta",
-                        "data/best_model/encoder.dict",
-                        "data/best_model/decoder.dict")
-    print(
-        composer.compose(
-            "~e3d efg2|~e3f gedB|~e3d efg2|G2AB gedB|\n", 300
-        )
-    )
+                        "data/best_model/codec.bin")
+    tune_text = "~e3d efg2|~e3f gedB|~e3d efg2|G2AB gedB|\n"
+    print(tune_text, end="")
+    # Bars are printed as soon as they are composed.
+    for bar in composer.stream(tune_text, 300, by_bars=True,
+                               terminator=composer.TUNE_TERMINATOR):
+        print(bar, end="", flush=True)
+    print()
 
 
 if __name__ == "__main__":
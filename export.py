@@ -0,0 +1,37 @@
+"""
+Entry point for export of the model used by numpy inference and of frozen,
+int8 quantized generation graph used by FrozenComposer. Export fails, if the
+numpy model doesn't match the tensorflow graph.
+"""
+
+
+from model.composer import Composer
+from model.frozen_composer import *
+from model.numpy_composer import (PARITY_TUNE, NumpyComposer, check_parity,
+                                  export_weights)
+
+
+def main():
+    export_weights("data/best_model/model", "data/best_model/weights.npz")
+    export_frozen_model("data/best_model/model", "data/best_model/model.meta",
+                        "data/best_model/frozen_int8.pb", quantize=True)
+    composer = Composer("data/best_model/model", "data/best_model/model.meta",
+                        "data/best_model/codec.bin")
+    numpy_composer = NumpyComposer("data/best_model/weights.npz",
+                                   "data/best_model/codec.bin")
+    frozen_composer = FrozenComposer("data/best_model/frozen_int8.pb",
+                                     "data/best_model/codec.bin")
+    try:
+        check_parity(composer, numpy_composer)
+        print("Numpy model matches the tensorflow graph.")
+        drift = measure_drift(composer, frozen_composer, PARITY_TUNE)
+        print("Quantized model drift:")
+        for name, value in drift.items():
+            print("    {}: {:.4f}".format(name, value))
+    finally:
+        composer.close()
+        frozen_composer.close()
+
+
+if __name__ == "__main__":
+    main()
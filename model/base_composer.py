@@ -0,0 +1,390 @@
+""" This module contains backend independent part of composers. """
+
+
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+from model.profiling import Instrumentation, measure
+from model.sampling import log_softmax, sample
+from processing.codec import Codec
+
+
+class BaseComposer(ABC):
+    """
+    This class describes composition routines shared by all composers. Derived
+    classes provide lstm state creation and a single step of the model over
+    batches of symbol indices, where index -1 stands for the zero input, which
+    returns output logits. Symbols are sampled from logits with temperature and
+    optional top-k or nucleus (top-p) truncation.
+    Optional PrefixStateCache lets prompts resume from states of their cached
+    prefixes. Prefixes ending with a newline, like abc header lines, and whole
+    prompts without their last symbols are cached.
+    Latency of every sampled token is measured with optional Instrumentation,
+    which is configured by environment variables, if it isn't given.
+    Derived classes can run the model over whole windows of symbols, which
+    are used to score tunes.
+    """
+
+    # Blank line, which ends tunes in abc notation.
+    TUNE_TERMINATOR = "\n\n"
+    BAR_LINE = "|"
+    # Width of scoring windows, if the model has no roll out of its own.
+    SCORING_ROLL_OUT = 20
+
+    def __init__(self, codec_file_path, state_cache=None, seed=None,
+                 instrumentation=None):
+        """ Load codec used by the model. """
+        self._codec = Codec.load(codec_file_path)
+        self._state_cache = state_cache
+        self._random = np.random.RandomState(seed)
+        if instrumentation is None:
+            instrumentation = Instrumentation.from_environment()
+        self._profiler = instrumentation
+
+    def compose(self, tune_text, generation_length, temperature=0.5,
+                top_k=None, top_p=None):
+        """
+        Generate generation_length new symbols and append them to tune_text.
+        """
+        return self.compose_batch([tune_text], generation_length, temperature,
+                                  top_k, top_p)[0]
+
+    def compose_batch(self, tunes_texts, generation_length, temperature=0.5,
+                      top_k=None, top_p=None):
+        """
+        Generate generation_length new symbols for every text in tunes_texts
+        in one batch and append them to the corresponding texts.
+        """
+        if len(tunes_texts) == 0:
+            return []
+        batch_size = len(tunes_texts)
+        state = self._create_state_matrix(batch_size)
+        # Rows with cached prompt prefixes start right after them.
+        prefixes_lengths = self._restore_cached_states(tunes_texts, state)
+        prompts, prompts_lengths = self._encode_prompts([
+            tune_text[prefix_length:] for tune_text, prefix_length
+            in zip(tunes_texts, prefixes_lengths)
+        ])
+        cached_steps = self._find_cached_steps(tunes_texts, prefixes_lengths,
+                                               len(prompts))
+        # Each row starts sampling on the last symbol of its prompt. Empty
+        # prompts are started from the zero input.
+        sampling_starts = np.maximum(prompts_lengths, 1) - 1
+        generated_chars = np.full(batch_size, -1, dtype=np.int64)
+        generated_indices = np.zeros([generation_length, batch_size],
+                                     dtype=np.int64)
+        for i in range(sampling_starts.max() + generation_length):
+            in_chars = generated_chars
+            if i < len(prompts):
+                # Rows still inside their prompts are fed with prompt symbols
+                # instead of the sampled ones.
+                in_chars = np.where(i < prompts_lengths, prompts[i],
+                                    generated_chars)
+            # Sampling is skipped while all rows are still reading prompts.
+            if i < sampling_starts.min():
+                _, state = self._run_step(in_chars, state, False)
+            else:
+                generated_chars, state = self.step(in_chars, state,
+                                                   temperature, top_k, top_p)
+            if i < len(cached_steps):
+                for row in np.flatnonzero(cached_steps[i]):
+                    self._state_cache.put(
+                        tunes_texts[row][:prefixes_lengths[row] + i + 1],
+                        state[:, :, row]
+                    )
+            if i < sampling_starts.min():
+                continue
+            positions = i - sampling_starts
+            is_sampling = (positions >= 0) & (positions < generation_length)
+            generated_indices[positions[is_sampling], is_sampling] = (
+                generated_chars[is_sampling]
+            )
+        return [tune_text + self.decode(generated_indices[:, i])
+                for i, tune_text in enumerate(tunes_texts)]
+
+    def stream(self, tune_text, generation_length, temperature=0.5,
+               by_bars=False, terminator=None, top_k=None, top_p=None):
+        """
+        Generate up to generation_length new symbols continuing tune_text and
+        yield them as soon as they are sampled, one by one or in whole bars if
+        by_bars is set. Generation stops early once generated text ends with
+        terminator.
+        """
+        state = self._read_prompt(tune_text)
+        in_index = self.encode(tune_text[-1])[0] if len(tune_text) > 0 else -1
+        generated_tail = ""
+        bar = ""
+        for _ in range(generation_length):
+            generated_indices, state = self.step(
+                np.array([in_index]), state, temperature, top_k, top_p
+            )
+            in_index = generated_indices[0]
+            char = self.decode([in_index])
+            is_terminated = False
+            if terminator:
+                generated_tail = (generated_tail + char)[-len(terminator):]
+                is_terminated = generated_tail == terminator
+            if not by_bars:
+                yield char
+            else:
+                bar += char
+                if char == self.BAR_LINE or is_terminated:
+                    yield bar
+                    bar = ""
+            if is_terminated:
+                return
+        if bar:
+            yield bar
+
+    def read_state(self, tune_text):
+        """ Get lstm state of the model after reading given tune text. """
+        state = self._read_prompt(tune_text)
+        if len(tune_text) > 0:
+            _, state = self._run_step(
+                self.encode(tune_text[-1]), state, False
+            )
+        return state
+
+    def read_logits(self, tune_text):
+        """
+        Feed tune text to the model and return [length, charset] matrix of
+        output logits, where row i scores symbol i given the preceding ones.
+        """
+        state = self._create_state_matrix(1)
+        in_indices = np.concatenate([[-1], self.encode(tune_text)[:-1]])
+        logits = np.zeros([len(tune_text), len(self._codec)],
+                          dtype=np.float32)
+        for i, in_index in enumerate(in_indices[:len(tune_text)]):
+            step_logits, state = self._run_step(np.array([in_index]), state,
+                                                True)
+            logits[i] = step_logits[0]
+        return logits
+
+    def create_state(self, batch_size):
+        """ Create zero lstm state for batch_size tunes used by step. """
+        return self._create_state_matrix(batch_size)
+
+    def step(self, in_indices, state, temperature, top_k=None, top_p=None):
+        """
+        Run single model step over array of symbol indices, where -1 stands
+        for no input, and lstm state of all rows. Return sampled symbol
+        indices, or None when temperature is None, and the new state.
+        """
+        if temperature is None:
+            return None, self._run_step(in_indices, state, False)[1]
+        with measure(self._profiler, "token"):
+            logits, state = self._run_step(in_indices, state, True)
+            generated_indices = sample(logits, self._random, temperature,
+                                       top_k, top_p)
+        if self._profiler is not None:
+            self._profiler.count("tokens", len(in_indices))
+            self._profiler.maybe_export(None)
+        return generated_indices, state
+
+    def beam_search(self, tune_text, generation_length, beam_width=8):
+        """
+        Find beam_width continuations of tune_text with generation_length new
+        symbols and the highest log-probabilities. All beams run in one batch
+        and fork their states by gathering rows. Return list of pairs of tune
+        texts and their log-probabilities, sorted from the most probable one.
+        """
+        state = np.repeat(self._read_prompt(tune_text), beam_width, axis=2)
+        in_index = self.encode(tune_text[-1])[0] if tune_text else -1
+        in_indices = np.full(beam_width, in_index, dtype=np.int64)
+        # Only the first beam is alive at start, so that beams are distinct.
+        scores = np.full(beam_width, -np.inf)
+        scores[0] = 0.0
+        histories = np.zeros([beam_width, 0], dtype=np.int64)
+        for _ in range(generation_length):
+            logits, state = self._run_step(in_indices, state, True)
+            candidates_scores = (scores[:, np.newaxis]
+                                 + log_softmax(logits)).ravel()
+            best_candidates = np.argpartition(
+                -candidates_scores, beam_width - 1
+            )[:beam_width]
+            parents, in_indices = np.divmod(best_candidates, logits.shape[1])
+            scores = candidates_scores[best_candidates]
+            state = state[:, :, parents]
+            histories = np.concatenate(
+                [histories[parents], in_indices[:, np.newaxis]], axis=1
+            )
+        order = np.argsort(-scores)
+        return [(tune_text + self.decode(histories[i]), scores[i])
+                for i in order if np.isfinite(scores[i])]
+
+    def score(self, tunes_texts, batch_size=64):
+        """
+        Compute log-probabilities of tunes under the model. Tunes are packed
+        into batch_size rows, where every row takes the next tune, once its
+        previous one ends, and starts it from zero state. Rows are fed in
+        windows of the model's roll out, like in training, where the model
+        reads a tune from zero state and predicts every next symbol, so the
+        first symbol of a tune is never scored. Return array of tunes
+        log-probabilities and list of arrays of log-probabilities of their
+        symbols but the first one, each given the preceding ones. Symbols
+        outside of the charset have log-probability of -inf.
+        """
+        if len(tunes_texts) == 0:
+            return np.zeros(0), []
+        symbols, offsets = self._codec.encode_many(tunes_texts,
+                                                   unknown_index=-1)
+        lengths = np.diff(offsets)
+        # Log-probability of symbol i + 1 is stored at position i + 1.
+        log_probabilities = np.zeros(len(symbols), dtype=np.float32)
+        # Queue is popped from the end, so the longest tunes go first and
+        # few rows are left running at the end.
+        queue = [tune for tune in np.argsort(lengths, kind="stable")
+                 if lengths[tune] > 1]
+        rows_tunes = np.full(batch_size, -1, dtype=np.int64)
+        rows_positions = np.zeros(batch_size, dtype=np.int64)
+        state = self._create_state_matrix(batch_size)
+        window = np.arange(self._get_roll_out())[:, np.newaxis]
+        while queue or (rows_tunes >= 0).any():
+            empty_rows = np.flatnonzero(rows_tunes < 0)[:len(queue)]
+            for row in empty_rows:
+                rows_tunes[row] = queue.pop()
+            rows_positions[empty_rows] = 0
+            state[:, :, empty_rows] = 0
+            tunes = np.maximum(rows_tunes, 0)
+            # Matrices in shape of [roll_out, batch] of positions in tunes and
+            # in the flat symbols array.
+            positions = rows_positions + window
+            symbols_positions = offsets[tunes] + positions
+            is_scored = (rows_tunes >= 0) & (positions + 1 < lengths[tunes])
+            in_indices = symbols.take(symbols_positions, mode="clip")
+            targets = symbols.take(symbols_positions + 1, mode="clip")
+            in_indices[~is_scored] = -1
+            with measure(self._profiler, "score"):
+                logits, state = self._run_window(in_indices, state)
+            targets_log_probabilities = np.take_along_axis(
+                log_softmax(logits), np.maximum(targets, 0)[..., np.newaxis],
+                axis=2
+            )[..., 0]
+            targets_log_probabilities[targets < 0] = -np.inf
+            log_probabilities[symbols_positions[is_scored] + 1] = (
+                targets_log_probabilities[is_scored]
+            )
+            if self._profiler is not None:
+                self._profiler.count("scored_symbols",
+                                     int(np.count_nonzero(is_scored)))
+            rows_positions += len(window)
+            rows_tunes[rows_positions + 1 >= lengths[tunes]] = -1
+        symbols_log_probabilities = [
+            tune_log_probabilities[1:] for tune_log_probabilities
+            in np.split(log_probabilities, offsets[1:-1])
+        ]
+        tunes_log_probabilities = np.array([
+            tune_log_probabilities.sum(dtype=np.float64)
+            for tune_log_probabilities in symbols_log_probabilities
+        ])
+        return tunes_log_probabilities, symbols_log_probabilities
+
+    def encode(self, tune_text):
+        """ Encode tune text to array of symbol indices. """
+        return self._codec.encode(tune_text)
+
+    def decode(self, chars_indices):
+        """ Decode array of symbol indices to text. """
+        return self._codec.decode(chars_indices)
+
+    def close(self):
+        pass
+
+    def _read_prompt(self, tune_text):
+        """
+        Feed all symbols of tune text but the last one to the model without
+        sampling, starting from the longest cached prefix, and return the
+        final state.
+        """
+        state = self._create_state_matrix(1)
+        prefix_length, = self._restore_cached_states([tune_text], state)
+        cached_steps = self._find_cached_steps(
+            [tune_text], [prefix_length], len(tune_text) - prefix_length - 1
+        )
+        chars_indices = self.encode(tune_text[prefix_length:-1])
+        for i, char_index in enumerate(chars_indices):
+            _, state = self._run_step(np.array([char_index]), state, False)
+            if cached_steps[i, 0]:
+                self._state_cache.put(tune_text[:prefix_length + i + 1],
+                                      state[:, :, 0])
+        return state
+
+    def _restore_cached_states(self, tunes_texts, state):
+        """
+        Fill rows of state with cached states of the longest prefixes of tunes
+        texts without their last symbols and return lengths of the prefixes.
+        """
+        prefixes_lengths = np.zeros(len(tunes_texts), dtype=np.int64)
+        if self._state_cache is None:
+            return prefixes_lengths
+        for i, tune_text in enumerate(tunes_texts):
+            prefix_length, cached_state = (
+                self._state_cache.get_longest_prefix(tune_text,
+                                                     len(tune_text) - 1)
+            )
+            if cached_state is not None:
+                state[:, :, i] = cached_state
+                prefixes_lengths[i] = prefix_length
+        return prefixes_lengths
+
+    def _find_cached_steps(self, tunes_texts, prefixes_lengths, steps_count):
+        """
+        Create [steps_count, batch] mask of reading steps, after which states
+        of tunes texts prefixes are cached. Step i of a row reads the symbol
+        right after its cached prefix extended by i symbols.
+        """
+        cached_steps = np.zeros([max(steps_count, 0), len(tunes_texts)],
+                                dtype=bool)
+        if self._state_cache is None:
+            return cached_steps
+        for row, (tune_text, prefix_length) in enumerate(
+                zip(tunes_texts, prefixes_lengths)):
+            last_length = len(tune_text) - 1
+            for length in range(prefix_length + 1, last_length + 1):
+                if tune_text[length - 1] == "\n" or length == last_length:
+                    cached_steps[length - prefix_length - 1, row] = True
+        return cached_steps
+
+    def _encode_prompts(self, tunes_texts):
+        """
+        Encode texts into [max_length, batch] matrix of symbol indices padded
+        with -1 and return it with the texts lengths.
+        """
+        symbols, offsets = self._codec.encode_many(tunes_texts)
+        prompts_lengths = np.diff(offsets)
+        prompts = np.full([prompts_lengths.max(), len(tunes_texts)], -1,
+                          dtype=np.int64)
+        rows = np.repeat(np.arange(len(tunes_texts)), prompts_lengths)
+        positions = np.arange(len(symbols)) - offsets[rows]
+        prompts[positions, rows] = symbols
+        return prompts, prompts_lengths
+
+    @abstractmethod
+    def _create_state_matrix(self, batch_size):
+        """ Create zero lstm state for batch_size generated tunes. """
+
+    def _get_roll_out(self):
+        """ Get number of symbols fed to _run_window at once. """
+        return self.SCORING_ROLL_OUT
+
+    def _run_window(self, in_indices, state):
+        """
+        Run the model over [roll_out, batch] matrix of symbol indices and
+        return [roll_out, batch, charset] logits and the new state. By default
+        model is run step by step.
+        """
+        logits = np.empty(in_indices.shape + (len(self._codec),),
+                          dtype=np.float32)
+        for i, step_indices in enumerate(in_indices):
+            step_logits, state = self._run_step(step_indices, state, True)
+            logits[i] = step_logits
+        return logits, state
+
+    @abstractmethod
+    def _run_step(self, in_indices, state, with_logits):
+        """
+        Run single model step over given symbol indices and lstm state. Return
+        output logits, which may be overwritten by the caller, or None when
+        with_logits is False, and the new state.
+        """
@@ -1,12 +1,20 @@
 """ This module contains basic model definition. """
 
 
+import pickle
+import time
+from functools import partial
+
 import tensorflow as tf
 import numpy as np
 
 from model.building import *
+from model.checkpointing import CheckpointWriter
 from model.composer import Composer
+from model.evaluation import AsyncEvaluator
+from model.profiling import Instrumentation, measure
 from processing.dataset import Dataset
+from processing.prefetching import BatchPrefetcher
 
 
 class BasicModel:
@@ -17,14 +25,23 @@ class BasicModel:
                          "test": Dataset.TEST}
 
     def __init__(self, build_params, train_root, val_root, checkpoints_root,
-                 best_model_root):
+                 best_model_root, threads_count=None, instrumentation=None):
+        """
+        Build the model. Hot paths of training are instrumented with given
+        Instrumentation, or with the one configured by environment variables.
+        """
+        self._build_params = build_params
+        if instrumentation is None:
+            instrumentation = Instrumentation.from_environment()
+        self._profiler = instrumentation
         self._create_paths(train_root, val_root, checkpoints_root,
                            best_model_root)
         self._create_placeholders(**build_params)
         self._build_net(**build_params)
-        self._build_training_nodes(build_params["charset_size"])
-        self._create_summary()
-        self._create_environment()
+        self._build_training_nodes(build_params["charset_size"],
+                                   build_params.get("data_parallel", False))
+        self._build_training_state_nodes()
+        self._create_environment(threads_count)
         self._register_infer_nodes()
 
     def train(
@@ -32,59 +49,229 @@ class BasicModel:
             max_iterations=1000000, decay_interval=10, decay_rate=1.0,
             save_interval=1000, best_save_interval=200,
             validation_interval=200, lstm_dropout=0.0, batch_size=50,
-            max_patience=20, early_stopping=False, charset_size=102
+            max_patience=20, early_stopping=False, charset_size=102,
+            prefetch_capacity=0, averager=None, validation_batches=None,
+            async_evaluation=False, pruner=None, resume=False
     ):
-        """ Public entry point for model's training. """
+        """
+        Public entry point for model's training. If prefetch_capacity is
+        positive, batches are prepared in background while the graph runs.
+        With GradientAverager given, model built with data_parallel set is
+        trained as one of data parallel workers. Only the chief worker
+        validates, saves and tests the model, so the other ones return None
+        for the final loss and accuracy.
+        If validation_batches is given, validation runs over the same sample
+        of that many batches every time instead of the whole subset. With
+        async_evaluation, whole subset validation of checkpoints and best
+        model saving run in a separate process, while training goes on.
+        Validation losses are reported to pruner, if it is given, and training
+        stops, once the pruner decides so. Checkpoints hold variables with
+        batching, learning rate and early stopping state, so with resume set,
+        training continues from the latest one, if there is any, on the same
+        batches. Dropout masks are drawn anew, so with lstm_dropout resumed
+        training isn't bit exact. Dataset has to be split the same way as in
+        the resumed run. Data parallel training always starts anew.
+        """
+        batch_source = dataset
+        if prefetch_capacity > 0:
+            batch_source = BatchPrefetcher(dataset, prefetch_capacity)
+        validation_source = batch_source
+        if validation_batches is not None:
+            validation_source = dataset.create_sample(Dataset.VAL,
+                                                      validation_batches)
         self._session.run(tf.global_variables_initializer())
+        is_chief = averager is None or averager.is_chief()
+        if averager is not None:
+            if not self._build_params.get("data_parallel", False):
+                raise ValueError("Model has to be built with data_parallel "
+                                 "set to be trained with an averager.")
+            self._broadcast_variables(averager)
+        evaluator = None
+        if is_chief and async_evaluation:
+            # Evaluator only validates, so it doesn't need parallel nodes.
+            evaluator = AsyncEvaluator(
+                dict(self._build_params, data_parallel=False),
+                self._val_root, self._checkpoints_root, self._best_model_root,
+                dataset, batch_size
+            )
         min_loss = -np.log(1 / charset_size)
         patience = max_patience
+        is_pruned = False
+        val_loss_out = None
         train_state = self._create_state_matrix(batch_size)
-        for iteration in range(max_iterations):
+        first_iteration = 0
+        training_state = None
+        if resume and averager is None:
+            training_state = self._restore_training_state()
+        if training_state is not None:
+            batch_source.set_state(training_state["batching"])
+            first_iteration = training_state["iteration"] + 1
+            learning_rate = training_state["learning_rate"]
+            min_loss = training_state["min_loss"]
+            patience = training_state["patience"]
+            val_loss_out = training_state["val_loss"]
+            train_state = training_state["carry_state"]
+            # Summaries written after the checkpoint are discarded.
+            for writer in [self._train_writer, self._val_writer]:
+                writer.add_session_log(
+                    tf.SessionLog(status=tf.SessionLog.START),
+                    global_step=first_iteration
+                )
+        for iteration in range(first_iteration, max_iterations):
             train_loss_out, _ = self._do_single_run(
-                "train", iteration, dataset, batch_size, learning_rate,
-                lstm_dropout, train_state, loops_limit=10
+                "train", iteration, batch_source, batch_size,
+                learning_rate, lstm_dropout, train_state, loops_limit=10,
+                averager=averager
             )
-            if iteration % validation_interval == 0:
+            if (is_chief and evaluator is None
+                    and iteration % validation_interval == 0):
                 val_loss_out, _ = self._do_single_run(
-                    "validation", iteration, dataset, batch_size, 0.0, 0.0
+                    "validation", iteration, validation_source, batch_size,
+                    0.0, 0.0
                 )
                 if val_loss_out < min_loss:
                     patience = max_patience
                 else:
                     patience -= 1
+                if pruner is not None:
+                    is_pruned = pruner.should_prune(iteration, val_loss_out)
+            if evaluator is not None:
+                if iteration % validation_interval == 0:
+                    self._checkpoint_writer.save(
+                        self._evaluation_saver, self._evaluation_file_path,
+                        global_step=iteration,
+                        callback=partial(evaluator.evaluate, iteration),
+                        latest_filename="evaluation_checkpoint"
+                    )
+                for val_iteration, val_loss_out in evaluator.get_results():
+                    if val_loss_out < min_loss:
+                        min_loss = val_loss_out
+                        patience = max_patience
+                    else:
+                        patience -= 1
+                    if pruner is not None:
+                        is_pruned = (pruner.should_prune(val_iteration,
+                                                         val_loss_out)
+                                     or is_pruned)
             if iteration % decay_interval == 0:
                 learning_rate *= decay_rate
-            if iteration % save_interval == 0:
-                self._checkpoints_saver.save(
-                    self._session, self._checkpoint_file_path,
-                    global_step=iteration
-                )
             # Save best model basing on validation loss.
-            if iteration % best_save_interval == 0 and val_loss_out < min_loss:
+            if (is_chief and evaluator is None
+                    and iteration % best_save_interval == 0
+                    and val_loss_out < min_loss):
                 min_loss = val_loss_out
-                self._best_model_saver.save(self._session,
-                                            self._best_model_file_path)
-            if train_loss_out < desired_loss:
-                break
+                self._checkpoint_writer.save(self._best_model_saver,
+                                             self._best_model_file_path)
+            # Checkpoint is saved last, so that it holds the state, which the
+            # next iteration starts from.
+            if is_chief and iteration % save_interval == 0:
+                self._store_training_state({
+                    "iteration": iteration, "learning_rate": learning_rate,
+                    "min_loss": min_loss, "patience": patience,
+                    "val_loss": val_loss_out, "carry_state": train_state,
+                    "batching": batch_source.get_state()
+                })
+                self._checkpoint_writer.save(
+                    self._checkpoints_saver, self._checkpoint_file_path,
+                    global_step=iteration
+                )
             # Early stopping.
-            if early_stopping and patience == 0:
+            should_stop = (train_loss_out < desired_loss
+                           or (early_stopping and patience == 0)
+                           or is_pruned)
+            # Workers stop together, once any of them wants to.
+            if averager is not None:
+                should_stop = averager.any(should_stop)
+            if should_stop:
                 break
-        self._best_model_saver.restore(self._session,
-                                       self._best_model_file_path)
-        final_loss, final_accuracy = self._do_single_run(
-            "test", -1, dataset, batch_size, 0.0, 0.0
-        )
+        final_loss = final_accuracy = None
+        # Evaluator can be waiting for the last checkpoint being written.
+        self._checkpoint_writer.wait()
+        if evaluator is not None:
+            # Best model is saved by the evaluator.
+            evaluator.close()
+        if is_chief:
+            self._best_model_saver.restore(self._session,
+                                           self._best_model_file_path)
+            final_loss, final_accuracy = self._do_single_run(
+                "test", -1, batch_source, batch_size, 0.0, 0.0
+            )
+        if prefetch_capacity > 0:
+            batch_source.close()
         return final_loss, final_accuracy
 
+    def measure_training_speed(self, dataset, steps_count, batch_size,
+                               learning_rate=0.001, averager=None,
+                               profiler=None):
+        """
+        Run steps_count training steps after a warm-up one and return number
+        of training sequences processed per second by this model. Sections of
+        measured steps are timed with StepProfiler, if it is given.
+        """
+        self._session.run(tf.global_variables_initializer())
+        if averager is not None:
+            self._broadcast_variables(averager)
+        state = self._create_state_matrix(batch_size)
+        self._do_single_run("train", 0, dataset, batch_size, learning_rate,
+                            0.0, state, loops_limit=1, averager=averager)
+        previous_profiler, self._profiler = self._profiler, profiler
+        start = time.perf_counter()
+        self._do_single_run("train", 1, dataset, batch_size, learning_rate,
+                            0.0, state, loops_limit=steps_count,
+                            averager=averager)
+        duration = time.perf_counter() - start
+        self._profiler = previous_profiler
+        return steps_count * batch_size / duration
+
+    def evaluate_checkpoints(self, dataset, batch_size, requests, results):
+        """
+        Validate checkpoints requested through requests queue with pairs of
+        iterations and checkpoint paths until None is received. Only the
+        latest of waiting requests is validated. Put pairs of iterations and
+        validation losses to results queue and save the best checkpoint as
+        the best model.
+        """
+        min_loss = -np.log(1 / self._build_params["charset_size"])
+        is_stopped = False
+        while not is_stopped:
+            waiting_requests = [requests.get()]
+            while not requests.empty():
+                waiting_requests.append(requests.get())
+            is_stopped = None in waiting_requests
+            waiting_requests = [request for request in waiting_requests
+                                if request is not None]
+            if not waiting_requests:
+                continue
+            iteration, checkpoint_path = waiting_requests[-1]
+            self._evaluation_saver.restore(self._session, checkpoint_path)
+            val_loss_out, _ = self._do_single_run(
+                "validation", iteration, dataset, batch_size, 0.0, 0.0
+            )
+            if val_loss_out < min_loss:
+                min_loss = val_loss_out
+                self._best_model_saver.save(self._session,
+                                            self._best_model_file_path)
+            results.put((iteration, val_loss_out))
+
     def _do_single_run(self, run_type, iteration, dataset, batch_size,
                        learning_rate, lstm_dropout, state=None,
-                       loops_limit=None):
-        """ Perform single run of selected type. """
+                       loops_limit=None, averager=None):
+        """
+        Perform single run of selected type. With averager given, training
+        steps apply gradients averaged over all workers.
+        """
         losses = []
         accuracies = []
-        # Determine which nodes to run and set index.
-        nodes_to_run = [self._loss, self._accuracy, self._out_state]
-        if run_type == "train":
+        # Determine which nodes to run and set index. When state is kept on
+        # device it is only updated in place and never fetched.
+        if self._state_on_device:
+            nodes_to_run = [self._loss, self._accuracy, self._carry_update]
+        else:
+            nodes_to_run = [self._loss, self._accuracy, self._out_state]
+        is_averaged = run_type == "train" and averager is not None
+        if is_averaged:
+            nodes_to_run += [self._flat_gradients]
+        elif run_type == "train":
             nodes_to_run += [self._train]
         set_index = self.RUN_TYPES_TO_SETS[run_type]
         keep_running = True
@@ -92,18 +279,57 @@ class BasicModel:
         # Construct state if needed.
         if state is None:
             state = self._create_state_matrix(batch_size)
+        writer = self._val_writer
+        if run_type == "train":
+            writer = self._train_writer
         while keep_running:
-            data, queue_reset = dataset.get_next_batch(set_index, state)
-            output = self._session.run(
-                nodes_to_run,
-                feed_dict={self._in_data: data,
-                           self._in_state: state,
-                           self._in_lstm_dropout: lstm_dropout,
-                           self._in_learning_rate: learning_rate}
-            )
+            with measure(self._profiler, "batch"):
+                data, reset_rows, queue_reset = (
+                    dataset.get_next_batch_with_resets(set_index)
+                )
+            with measure(self._profiler, "feed"):
+                feed_dict = {self._in_data: data,
+                             self._in_lstm_dropout: lstm_dropout,
+                             self._in_learning_rate: learning_rate}
+                if self._state_on_device:
+                    # Every run starts from zero state, just like on the host.
+                    if loops_count == 0:
+                        reset_rows[:] = True
+                    feed_dict[self._in_reset_mask] = 1.0 - reset_rows
+            if not self._state_on_device:
+                # Feeding and fetching state happen inside session run, so
+                # they are timed as a part of compute.
+                with measure(self._profiler, "state_reset"):
+                    # State is in shape of [layers, 2, batch, num_neurons] and
+                    # rows of replaced tunes start from zero state.
+                    state[:, :, reset_rows] = 0
+                    feed_dict[self._in_state] = state
+            run_options = run_metadata = None
+            if self._profiler is not None:
+                self._profiler.count(run_type + "_steps")
+                self._profiler.count(run_type + "_symbols", data.size)
+                self._profiler.count("state_resets",
+                                     int(np.count_nonzero(reset_rows)))
+                if self._profiler.should_trace():
+                    run_options = tf.RunOptions(
+                        trace_level=tf.RunOptions.FULL_TRACE
+                    )
+                    run_metadata = tf.RunMetadata()
+            with measure(self._profiler, "compute"):
+                output = self._session.run(nodes_to_run, feed_dict=feed_dict,
+                                           options=run_options,
+                                           run_metadata=run_metadata)
+                if is_averaged:
+                    self._session.run(self._apply_gradients, feed_dict={
+                        self._in_flat_gradients: averager.average(output[3]),
+                        self._in_learning_rate: learning_rate
+                    })
+            if run_metadata is not None:
+                writer.add_run_metadata(run_metadata, "{}_{}_{}".format(
+                    run_type, iteration, loops_count
+                ))
             # Unpack loss and accuracy from run output.
-            loss, accuracy, out_state = output[:3]
-            state = np.array(out_state)
+            loss, accuracy, state = output[:3]
             losses.append(loss)
             accuracies.append(accuracy)
             loops_count += 1
@@ -115,15 +341,76 @@ class BasicModel:
         # Log obtained loss and accuracy values.
         mean_loss = np.mean(losses)
         mean_accuracy = np.mean(accuracies)
-        self._output_summary(run_type, iteration, mean_loss, mean_accuracy)
+        with measure(self._profiler, "summary"):
+            self._output_summary(run_type, iteration, mean_loss,
+                                 mean_accuracy)
+        if self._profiler is not None:
+            self._profiler.maybe_export(iteration, writer)
         return mean_loss, mean_accuracy
 
-    def _output_summary(self, run_type, iteration, loss, accuracy):
-        """ Output loss and accuracy summary to selected writer. """
-        summary_out, = self._session.run(
-            [self._summary],
-            feed_dict={self._in_loss: loss, self._in_accuracy: accuracy}
+    def _store_training_state(self, training_state):
+        """
+        Store pickled training state in its variable, so that it is saved
+        with the next checkpoint.
+        """
+        self._session.run(self._assign_training_state, feed_dict={
+            self._in_training_state: pickle.dumps(training_state)
+        })
+
+    def _restore_training_state(self):
+        """
+        Restore variables from the latest checkpoint and return training
+        state saved with them, or None, if there is no checkpoint yet.
+        """
+        checkpoint_path = tf.train.latest_checkpoint(self._checkpoints_root)
+        if checkpoint_path is None:
+            return None
+        self._check_checkpoint(checkpoint_path)
+        self._checkpoints_saver.restore(self._session, checkpoint_path)
+        return pickle.loads(self._session.run(self._training_state))
+
+    def _check_checkpoint(self, checkpoint_path):
+        """
+        Check, that the checkpoint holds all variables of the model with their
+        shapes, and raise ValueError otherwise.
+        """
+        saved_shapes = dict(tf.train.list_variables(checkpoint_path))
+        for variable in tf.global_variables():
+            name = variable.op.name
+            if name not in saved_shapes:
+                raise ValueError(
+                    "Checkpoint {} has no variable {}, so it was saved by a "
+                    "different model or before training state was kept in "
+                    "checkpoints. Remove it or train with resume=False."
+                    .format(checkpoint_path, name)
+                )
+            if (variable.shape.is_fully_defined()
+                    and variable.shape.as_list() != saved_shapes[name]):
+                raise ValueError(
+                    "Checkpoint {} holds variable {} of shape {} instead of "
+                    "{}, so it was saved with different build parameters. "
+                    "Remove it or train with resume=False."
+                    .format(checkpoint_path, name, saved_shapes[name],
+                            variable.shape.as_list())
+                )
+
+    def _broadcast_variables(self, averager):
+        """ Overwrite variables of all workers with the chief's ones. """
+        flat_variables = averager.broadcast(
+            self._session.run(self._flat_variables)
         )
+        self._session.run(self._assign_variables,
+                          feed_dict={self._in_flat_variables: flat_variables})
+
+    def _output_summary(self, run_type, iteration, loss, accuracy):
+        """
+        Output loss and accuracy summary to selected writer. Summary is built
+        on the host, writers queue it and write it in their own threads.
+        """
+        summary_out = tf.Summary(value=[
+            tf.Summary.Value(tag="loss", simple_value=loss),
+            tf.Summary.Value(tag="accuracy", simple_value=accuracy)
+        ])
         if run_type == "train":
             self._train_writer.add_summary(summary_out, global_step=iteration)
         elif run_type == "validation":
@@ -147,12 +434,15 @@ class BasicModel:
         self._best_model_root = best_model_root
         self._checkpoint_file_path = self._checkpoints_root + "/model"
         self._best_model_file_path = self._best_model_root + "/model"
+        self._evaluation_file_path = self._checkpoints_root + "/evaluation"
 
     def _create_placeholders(self, layers_count=3, layers_size=512, roll_out=20,
-                             charset_size=102):
+                             charset_size=102, state_on_device=False,
+                             lstm_implementation=BASIC_LSTM,
+                             data_parallel=False):
         """ Create necessary model's placeholders. """
-        self._in_data = tf.placeholder(tf.float32,
-                                       shape=[roll_out, None, charset_size])
+        self._state_on_device = state_on_device
+        self._in_data = tf.placeholder(tf.int32, shape=[roll_out, None])
         self._in_generation_data = tf.placeholder(tf.float32,
                                                   shape=[None, charset_size])
         self._in_state = tf.placeholder(
@@ -161,51 +451,145 @@ class BasicModel:
         self._in_temperature = tf.placeholder(tf.float32, shape=[])
         self._in_learning_rate = tf.placeholder(tf.float32, shape=[])
         self._in_lstm_dropout = tf.placeholder(tf.float32, shape=[])
+        # Mask of batch rows, which keep their state, where 0.0 marks a reset.
+        self._in_reset_mask = tf.placeholder(tf.float32, shape=[None])
 
     def _build_net(self, layers_count=3, layers_size=512, roll_out=20,
-                   charset_size=102):
+                   charset_size=102, state_on_device=False,
+                   lstm_implementation=BASIC_LSTM, data_parallel=False):
         """ Build whole network. """
-        cell = build_lstm_cell(layers_count, layers_size, self._in_lstm_dropout)
+        cell = build_lstm_cell(layers_count, layers_size, self._in_lstm_dropout,
+                               lstm_implementation)
         out_weights, out_biases = build_linear_layer("out", layers_size,
                                                      charset_size)
-        self._final_outs, self._out_state = build_train_graph(
-            cell, out_weights, out_biases, self._in_state, self._in_data,
-            roll_out, charset_size
+        # State the roll out starts from is kept, so that it can be fed in
+        # scoring, even if the state is carried on device.
+        self._rolled_out_in_state = self._in_state
+        if state_on_device:
+            self._rolled_out_in_state = self._build_carry_state(layers_count,
+                                                                layers_size)
+        self._final_outs, out_state = build_train_graph(
+            cell, out_weights, out_biases, self._rolled_out_in_state,
+            tf.one_hot(self._in_data, charset_size), roll_out, charset_size,
+            lstm_implementation
         )
-        self._generated_symbols, self._generated_state = build_generation_graph(
+        # Output state is stacked in the graph, so it is fetched as one matrix.
+        self._out_state = tf.stack([tf.stack(layer_state)
+                                    for layer_state in out_state])
+        if state_on_device:
+            self._carry_update = tf.assign(
+                self._carry_state, self._out_state, validate_shape=False
+            ).op
+        (self._generated_symbols, self._generated_logits,
+         self._generated_state) = build_generation_graph(
             cell, out_weights, out_biases, self._in_state,
-            self._in_generation_data, self._in_temperature
+            self._in_generation_data, self._in_temperature, lstm_implementation
         )
 
-    def _build_training_nodes(self, charset_size):
-        """ Create training nodes. """
+    def _build_carry_state(self, layers_count, layers_size):
+        """
+        Create non-trainable variable, which carries lstm state between
+        training steps, and return state read from it with rows reset by the
+        reset mask. Whole state is reset, when batch size changes.
+        """
+        self._carry_state = tf.Variable(
+            tf.zeros([layers_count, 2, 0, layers_size]), trainable=False,
+            validate_shape=False, name="carry_state"
+        )
+        batch_size = tf.shape(self._in_reset_mask)[0]
+        state = tf.cond(
+            tf.equal(tf.shape(self._carry_state)[2], batch_size),
+            lambda: (self._carry_state
+                     * self._in_reset_mask[tf.newaxis, tf.newaxis, :,
+                                           tf.newaxis]),
+            lambda: tf.zeros([layers_count, 2, batch_size, layers_size])
+        )
+        return tf.reshape(state, [layers_count, 2, -1, layers_size])
+
+    def _build_training_nodes(self, charset_size, data_parallel):
+        """
+        Create training nodes. Nodes of data parallel training are created
+        only if data_parallel is set, so that other graphs don't carry them.
+        """
         logits = tf.reshape(self._final_outs[:-1], [-1, charset_size])
-        labels = tf.reshape(self._in_data[1:], [-1, charset_size])
+        labels = tf.reshape(self._in_data[1:], [-1])
         self._loss = tf.reduce_mean(
-            tf.nn.softmax_cross_entropy_with_logits(logits=logits,
-                                                    labels=labels)
+            tf.nn.sparse_softmax_cross_entropy_with_logits(logits=logits,
+                                                           labels=labels)
         )
+        predictions = tf.cast(tf.argmax(logits, 1), dtype=tf.int32)
         self._accuracy = tf.reduce_mean(
-            tf.cast(tf.equal(tf.argmax(logits, 1), tf.argmax(labels, 1)),
-                    dtype=tf.float32)
+            tf.cast(tf.equal(predictions, labels), dtype=tf.float32)
         )
-        self._train = tf.train.AdamOptimizer(
+        optimizer = tf.train.AdamOptimizer(
             learning_rate=self._in_learning_rate
-        ).minimize(self._loss)
-
-    def _create_summary(self):
-        """ Create train and validation summary nodes. """
-        self._in_loss = tf.placeholder(tf.float32, [])
-        self._in_accuracy = tf.placeholder(tf.float32, [])
-        tf.summary.scalar("loss", self._in_loss)
-        tf.summary.scalar("accuracy", self._in_accuracy)
-        self._summary = tf.summary.merge_all()
-
-    def _create_environment(self):
-        """ Create training environment. """
-        self._session = tf.Session()
+        )
+        gradients_and_variables = optimizer.compute_gradients(self._loss)
+        self._train = optimizer.apply_gradients(gradients_and_variables)
+        if data_parallel:
+            self._build_parallel_nodes(optimizer, gradients_and_variables)
+
+    def _build_parallel_nodes(self, optimizer, gradients_and_variables):
+        """
+        Create nodes used in data parallel training. Gradients and variables
+        are exchanged between workers as flat vectors, so that every exchange
+        is a single buffer.
+        """
+        gradients, variables = zip(*gradients_and_variables)
+        sizes = [int(np.prod(variable.shape.as_list()))
+                 for variable in variables]
+        self._flat_gradients = tf.concat(
+            [tf.reshape(gradient, [-1]) for gradient in gradients], 0
+        )
+        self._in_flat_gradients = tf.placeholder(tf.float32, [sum(sizes)])
+        self._apply_gradients = optimizer.apply_gradients([
+            (tf.reshape(gradient, variable.shape), variable)
+            for gradient, variable
+            in zip(tf.split(self._in_flat_gradients, sizes), variables)
+        ])
+        self._flat_variables = tf.concat(
+            [tf.reshape(variable, [-1]) for variable in variables], 0
+        )
+        self._in_flat_variables = tf.placeholder(tf.float32, [sum(sizes)])
+        self._assign_variables = tf.group(*[
+            tf.assign(variable, tf.reshape(value, variable.shape))
+            for value, variable
+            in zip(tf.split(self._in_flat_variables, sizes), variables)
+        ])
+
+    def _build_training_state_nodes(self):
+        """
+        Create variable, which holds pickled host side training state, like
+        dataset queues, learning rate and early stopping counters, so that it
+        is saved in checkpoints together with the model and optimizer.
+        """
+        self._training_state = tf.Variable("", trainable=False,
+                                           name="training_state")
+        self._in_training_state = tf.placeholder(tf.string, shape=[])
+        self._assign_training_state = tf.assign(self._training_state,
+                                                self._in_training_state)
+
+    def _create_environment(self, threads_count=None):
+        """
+        Create training environment. Session uses at most threads_count
+        threads per operation, if it is given.
+        """
+        config = None
+        if threads_count is not None:
+            config = tf.ConfigProto(
+                intra_op_parallelism_threads=threads_count,
+                inter_op_parallelism_threads=threads_count
+            )
+        self._session = tf.Session(config=config)
         self._best_model_saver = tf.train.Saver(max_to_keep=1)
         self._checkpoints_saver = tf.train.Saver(max_to_keep=10)
+        # Checkpoints requested from asynchronous evaluator are kept, until
+        # it catches up with training.
+        self._evaluation_saver = tf.train.Saver(max_to_keep=3)
+        self._checkpoint_writer = CheckpointWriter(
+            self._session, [self._best_model_saver, self._checkpoints_saver,
+                            self._evaluation_saver]
+        )
         self._train_writer = tf.summary.FileWriter(self._train_root)
         self._val_writer = tf.summary.FileWriter(self._val_root)
 
@@ -218,6 +602,12 @@ class BasicModel:
         tf.add_to_collection(Composer.IN_LSTM_DROPOUT, self._in_lstm_dropout)
         tf.add_to_collection(Composer.GENERATED_SYMBOLS,
                              self._generated_symbols)
+        tf.add_to_collection(Composer.GENERATED_LOGITS,
+                             self._generated_logits)
+        tf.add_to_collection(Composer.IN_DATA, self._in_data)
+        tf.add_to_collection(Composer.IN_STATE, self._rolled_out_in_state)
+        tf.add_to_collection(Composer.ROLLED_OUT_LOGITS, self._final_outs)
+        tf.add_to_collection(Composer.ROLLED_OUT_STATE, self._out_state)
         self._register_generated_state()
 
     def _register_generated_state(self):
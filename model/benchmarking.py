@@ -0,0 +1,153 @@
+"""
+This module contains training throughput benchmark, which runs the model on
+a synthetic corpus over a grid of build and batching parameters.
+"""
+
+
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import subprocess
+import tempfile
+import time
+
+from model.profiling import StepProfiler
+from processing.synthetic import write_synthetic_csv
+
+
+__all__ = ["DEFAULT_GRID", "run_benchmarks", "save_results",
+           "compare_results"]
+
+
+DEFAULT_GRID = {"batch_size": [50, 100], "roll_out": [20, 50],
+                "layers_size": [128, 256], "layers_count": [2, 3]}
+# Parameters, which identify single benchmark in results.
+CONFIG_KEYS = ["batch_size", "roll_out", "layers_size", "layers_count",
+               "lstm_implementation", "state_on_device"]
+
+
+def run_benchmarks(grid=None, steps_count=50, tunes_count=2000,
+                   extra_build_params=None):
+    """
+    Run training benchmark for every combination of grid parameters and
+    return list of results. Every benchmark runs in a separate process, so
+    that graph build time and peak memory usage are measured for it alone.
+    Extra build parameters, like lstm_implementation, are passed to all
+    models.
+    """
+    grid = DEFAULT_GRID if grid is None else grid
+    names = list(grid)
+    results = []
+    context = multiprocessing.get_context("spawn")
+    with tempfile.TemporaryDirectory() as data_root:
+        csv_path = os.path.join(data_root, "tunes.csv")
+        write_synthetic_csv(csv_path, tunes_count)
+        for values in itertools.product(*(grid[name] for name in names)):
+            config = dict(extra_build_params or {})
+            config.update(zip(names, values))
+            results_queue = context.Queue()
+            process = context.Process(
+                target=_run_benchmark,
+                args=[config, csv_path, steps_count, results_queue]
+            )
+            process.start()
+            result = results_queue.get()
+            process.join()
+            if isinstance(result, Exception):
+                raise result
+            results.append(result)
+    return results
+
+
+def save_results(results, file_path):
+    """
+    Save benchmark results with description of the code version and the
+    machine they were measured on to .json file.
+    """
+    report = {"commit": _get_commit(), "time": time.time(),
+              "machine": platform.platform(), "cpu_count": os.cpu_count(),
+              "results": results}
+    with open(file_path, "w") as file:
+        json.dump(report, file, indent=2)
+
+
+def compare_results(baseline_file_path, results):
+    """
+    Compare results with the ones saved in baseline file. Return list of
+    pairs of configs present in both and their chars per second speedups.
+    """
+    with open(baseline_file_path) as file:
+        baseline = {_get_config_key(result): result
+                    for result in json.load(file)["results"]}
+    comparison = []
+    for result in results:
+        baseline_result = baseline.get(_get_config_key(result))
+        if baseline_result is not None:
+            comparison.append((result["config"],
+                               result["chars_per_second"]
+                               / baseline_result["chars_per_second"]))
+    return comparison
+
+
+def _run_benchmark(config, csv_path, steps_count, results_queue):
+    """ Run single benchmark and put its result to the queue. """
+    try:
+        results_queue.put(_measure(config, csv_path, steps_count))
+    except Exception as error:
+        results_queue.put(error)
+
+
+def _measure(config, csv_path, steps_count):
+    """
+    Build model with config, train it for steps_count steps and measure
+    throughput, steps sections durations, graph build time and peak memory.
+    """
+    # Tensorflow is imported only in benchmark processes.
+    from model.basic_model import BasicModel
+    from processing.dataset import Dataset
+    dataset = Dataset(csv_path, {}, config["batch_size"], config["roll_out"],
+                      [0.8, 0.1, 0.1], split_seed=0)
+    build_params = {name: value for name, value in config.items()
+                    if name != "batch_size"}
+    build_params["charset_size"] = dataset.get_charset_size()
+    with tempfile.TemporaryDirectory() as logs_root:
+        start = time.perf_counter()
+        model = BasicModel(build_params, *[
+            os.path.join(logs_root, name) for name
+            in ["train", "validation", "checkpoints", "best_model"]
+        ])
+        build_time = time.perf_counter() - start
+        profiler = StepProfiler()
+        sequences_per_second = model.measure_training_speed(
+            dataset, steps_count, config["batch_size"], profiler=profiler
+        )
+    breakdown = profiler.get_breakdown()
+    return {
+        "config": config,
+        "chars_per_second": sequences_per_second * config["roll_out"],
+        "step_time": {section: breakdown[section]["total"] / steps_count
+                      for section in breakdown},
+        "graph_build_time": build_time,
+        # Maximum resident set size is reported in kilobytes on linux.
+        "peak_rss_mb": (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+                        / 1024)
+    }
+
+
+def _get_config_key(result):
+    """ Get hashable identifier of result's config. """
+    return tuple(result["config"].get(key) for key in CONFIG_KEYS)
+
+
+def _get_commit():
+    """ Get current git commit hash, if code is run from a repository. """
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
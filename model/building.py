@@ -4,12 +4,51 @@
 import tensorflow as tf
 
 
-__all__ = ["build_lstm_cell", "build_linear_layer", "build_train_graph",
+__all__ = ["BASIC_LSTM", "DYNAMIC_LSTM", "FUSED_LSTM", "FusedMultiLSTMCell",
+           "build_lstm_cell", "build_linear_layer", "build_train_graph",
            "build_generation_graph"]
 
 
-def build_lstm_cell(layers_count, layers_size, in_lstm_dropout):
+# Available lstm implementations. Basic one unrolls the training graph in
+# python, dynamic one runs the same cell in a while loop and fused one runs
+# every layer over the whole sequence in a single block lstm op.
+BASIC_LSTM, DYNAMIC_LSTM, FUSED_LSTM = "basic", "dynamic", "fused"
+
+
+class FusedMultiLSTMCell:
+    """
+    This class describes multi-layer lstm made of fused block lstm layers,
+    which work on whole time major sequences. Variables are named and laid out
+    like the ones of the basic multi-layer cell, so checkpoints of both are
+    compatible.
+    """
+
+    def __init__(self, layers_count, layers_size, in_lstm_dropout):
+        self._in_lstm_dropout = in_lstm_dropout
+        self._layers = [
+            tf.contrib.rnn.LSTMBlockFusedCell(layers_size,
+                                              name="basic_lstm_cell")
+            for _ in range(layers_count)
+        ]
+
+    def __call__(self, in_data, state):
+        """ Run all layers over in_data sequence starting from given state. """
+        out_state = []
+        for i, layer in enumerate(self._layers):
+            with tf.variable_scope("multi_rnn_cell/cell_{}".format(i)):
+                in_data, layer_state = layer(in_data, initial_state=state[i])
+            # Dropout is applied to outputs of all layers but the last one.
+            if i != len(self._layers) - 1:
+                in_data = tf.nn.dropout(in_data, 1.0 - self._in_lstm_dropout)
+            out_state.append(layer_state)
+        return in_data, tuple(out_state)
+
+
+def build_lstm_cell(layers_count, layers_size, in_lstm_dropout,
+                    implementation=BASIC_LSTM):
     """ Build multi-layer lstm cell, where all layers have the same size. """
+    if implementation == FUSED_LSTM:
+        return FusedMultiLSTMCell(layers_count, layers_size, in_lstm_dropout)
     cells = []
     for i in range(layers_count):
         cell = tf.contrib.rnn.BasicLSTMCell(layers_size)
@@ -36,31 +75,57 @@ def build_linear_layer(name, in_size, out_size):
 
 
 def build_train_graph(cell, out_weights, out_biases, previous_state, in_data,
-                      roll_out, charset_size):
+                      roll_out, charset_size, implementation=BASIC_LSTM):
     """ Build lstm train graph with roll_out number of steps. """
-    outs = []
-    state = []
-    # Reformat previous state to fit tensorflow requirements.
-    for i in range(previous_state.shape[0]):
-        state.append((previous_state[i, 0], previous_state[i, 1]))
-    for i in range(roll_out):
-        out, state = cell(in_data[i], state)
-        outs.append(out)
-    final_outs = tf.matmul(tf.concat(outs, axis=0), out_weights) + out_biases
+    state = _unpack_state(previous_state)
+    if implementation == BASIC_LSTM:
+        outs = []
+        for i in range(roll_out):
+            out, state = cell(in_data[i], state)
+            outs.append(out)
+        outs = tf.concat(outs, axis=0)
+    else:
+        if implementation == DYNAMIC_LSTM:
+            # Variables are created in the root scope, like in the basic graph.
+            outs, state = tf.nn.dynamic_rnn(
+                cell, in_data, initial_state=state, time_major=True,
+                scope=tf.get_variable_scope()
+            )
+        else:
+            outs, state = cell(in_data, state)
+        outs = tf.reshape(outs, [-1, outs.shape.as_list()[-1]])
+    final_outs = tf.matmul(outs, out_weights) + out_biases
     final_outs = tf.reshape(final_outs, [roll_out, -1, charset_size])
     return final_outs, state
 
 
 def build_generation_graph(cell, out_weights, out_biases, previous_state,
-                           in_data, temperature):
-    """ Build one step lstm graph used in generation. """
-    state = []
-    # Reformat previous state to fit tensorflow requirements.
-    for i in range(previous_state.shape[0]):
-        state.append((previous_state[i, 0], previous_state[i, 1]))
-    out, state = cell(in_data, state)
+                           in_data, temperature, implementation=BASIC_LSTM):
+    """
+    Build one step lstm graph used in generation. Return sampled symbols
+    one-hot encoded, output logits and the new state.
+    """
+    state = _unpack_state(previous_state)
+    if implementation == FUSED_LSTM:
+        # Fused cell works on sequences, so a sequence of one step is used.
+        outs, state = cell(in_data[tf.newaxis], state)
+        out = outs[0]
+    else:
+        out, state = cell(in_data, state)
     final_out = tf.matmul(out, out_weights) + out_biases
     generated_class = tf.one_hot(tf.multinomial(final_out / temperature, 1),
                                  final_out.shape[-1])
-    generated_class = tf.squeeze(generated_class, [0])
-    return generated_class, state
+    generated_class = tf.squeeze(generated_class, [1])
+    return generated_class, final_out, state
+
+
+def _unpack_state(previous_state):
+    """
+    Reformat previous state matrix in shape of [layers, 2, batch, size] to fit
+    tensorflow requirements.
+    """
+    state = []
+    for i in range(previous_state.shape[0]):
+        state.append(tf.nn.rnn_cell.LSTMStateTuple(previous_state[i, 0],
+                                                   previous_state[i, 1]))
+    return tuple(state)
@@ -0,0 +1,91 @@
+"""
+This module contains checkpoint writer, which saves model's variables in
+a background thread, so that training isn't stalled by checkpoint writing.
+"""
+
+
+from concurrent.futures import ThreadPoolExecutor
+
+import tensorflow as tf
+
+
+__all__ = ["CheckpointWriter"]
+
+
+class CheckpointWriter:
+    """
+    This class describes writer, which copies all global variables to their
+    local snapshots on device and saves the snapshots under names of the
+    original variables in a separate thread. Training can update variables
+    meanwhile, so only the copy blocks the caller. Checkpoints can be
+    restored with the original savers, which the writer mirrors.
+    """
+
+    def __init__(self, session, savers):
+        self._session = session
+        snapshots = {}
+        assigns = []
+        for variable in tf.global_variables():
+            # Variables without fixed shape, like the carry state, need their
+            # snapshots to be reshaped on assignment.
+            is_shape_fixed = variable.shape.is_fully_defined()
+            initial_value = variable.initial_value
+            if variable.dtype.base_dtype != tf.string:
+                initial_value = tf.zeros_like(initial_value)
+            snapshot = tf.Variable(
+                initial_value, trainable=False,
+                validate_shape=is_shape_fixed,
+                collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                name=variable.op.name.replace("/", "_") + "_snapshot"
+            )
+            snapshots[variable.op.name] = snapshot
+            assigns.append(tf.assign(snapshot, variable,
+                                     validate_shape=is_shape_fixed))
+        self._take_snapshot = tf.group(*assigns)
+        self._snapshot_savers = {
+            saver: tf.train.Saver(snapshots,
+                                  max_to_keep=saver.saver_def.max_to_keep)
+            for saver in savers
+        }
+        self._session.run(tf.variables_initializer(list(snapshots.values())))
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending_save = None
+
+    def save(self, saver, file_path, global_step=None, callback=None,
+             **kwargs):
+        """
+        Save current variables in the way given saver would, where kwargs are
+        passed to Saver.save. Snapshot is taken right away, once the previous
+        save has finished, and callback is called with the saved checkpoint
+        path from the writer thread.
+        """
+        self.wait()
+        self._session.run(self._take_snapshot)
+        self._pending_save = self._executor.submit(
+            self._write, saver, file_path, global_step, callback, kwargs
+        )
+
+    def wait(self):
+        """ Wait until the last requested save is written. """
+        if self._pending_save is not None:
+            pending_save, self._pending_save = self._pending_save, None
+            pending_save.result()
+
+    def close(self):
+        """ Write pending save and stop the writer thread. """
+        self.wait()
+        self._executor.shutdown()
+
+    def _write(self, saver, file_path, global_step, callback, kwargs):
+        """
+        Write snapshot checkpoint and meta graph of the original saver, so
+        that models imported from it restore the original variables.
+        """
+        checkpoint_path = self._snapshot_savers[saver].save(
+            self._session, file_path, global_step=global_step,
+            write_meta_graph=False, **kwargs
+        )
+        tf.train.export_meta_graph(checkpoint_path + ".meta",
+                                   saver_def=saver.saver_def)
+        if callback is not None:
+            callback(checkpoint_path)
@@ -1,17 +1,18 @@
 """ This module contains class capable of infering. """
 
 
-import pickle
 import tensorflow as tf
 import numpy as np
 
-from processing.data_utils import encode_tune_text, decode_tune_matrix
+from model.base_composer import BaseComposer
+from model.profiling import measure
 
 
-class Composer:
+class Composer(BaseComposer):
     """
     This class describes object capable of music composition with learned lstm
-    model.
+    model. Tunes are scored with the training roll out of the model, if it
+    was saved with it.
     """
 
     IN_TEMPERATURE = "temperature"
@@ -20,65 +21,110 @@ class Composer:
     IN_LSTM_DROPOUT = "in_lstm_dropout"
     GENERATED_SYMBOLS = "generated_symbols"
     GENERATED_STATE = "generated_state"
+    GENERATED_LOGITS = "generated_logits"
+    IN_DATA = "in_data"
+    IN_STATE = "in_state"
+    ROLLED_OUT_LOGITS = "rolled_out_logits"
+    ROLLED_OUT_STATE = "rolled_out_state"
 
-    def __init__(self, model_file_path, meta_file_path, encoder_file_path,
-                 decoder_file_path):
+    def __init__(self, model_file_path, meta_file_path, codec_file_path,
+                 state_cache=None, seed=None, instrumentation=None):
         """ Setup environment. """
+        super().__init__(codec_file_path, state_cache, seed, instrumentation)
         self._session = tf.Session()
         saver = tf.train.import_meta_graph(meta_file_path)
         saver.restore(self._session, model_file_path)
-        self._in_temperature = tf.get_collection(self.IN_TEMPERATURE)[0]
         self._in_generation_data = tf.get_collection(self.IN_GENERATION_DATA)[0]
         self._in_generation_state = tf.get_collection(
             self.IN_GENERATION_STATE
         )[0]
         self._in_lstm_dropout = tf.get_collection(self.IN_LSTM_DROPOUT)[0]
-        self._generated_symbols = tf.get_collection(self.GENERATED_SYMBOLS)[0]
-        self._get_generated_state()
-        self._load_encoding(encoder_file_path, decoder_file_path)
+        self._generated_logits = self.find_generated_logits()
+        self._generated_state = self.find_generated_state()
+        # Models saved before the roll out was registered are scored step by
+        # step.
+        self._rolled_out_logits = None
+        if tf.get_collection(self.ROLLED_OUT_LOGITS):
+            self._in_data = tf.get_collection(self.IN_DATA)[0]
+            self._in_state = tf.get_collection(self.IN_STATE)[0]
+            self._rolled_out_logits = tf.get_collection(
+                self.ROLLED_OUT_LOGITS
+            )[0]
+            self._rolled_out_state = tf.get_collection(
+                self.ROLLED_OUT_STATE
+            )[0]
 
-    def compose(self, tune_text, generation_length):
+    @classmethod
+    def find_generated_logits(cls):
         """
-        Generate generation_length new symbols and append them to tune_text.
+        Find output logits of the generation graph in the default graph.
+        Symbols are sampled outside of the graph from its output logits.
+        Models saved before logits were registered only hold sampled symbols,
+        so logits are found as the input of their scaling by temperature.
         """
-        state = np.zeros([len(self._generated_state), 2, 1,
-                          self._generated_state[0].c.shape.as_list()[-1]])
-        generated_text = ""
-        for i in range(len(tune_text) + generation_length):
-            if i < len(tune_text):
-                encoded_char = encode_tune_text(tune_text[i], self._encoder)
-            else:
-                encoded_char = generated_char
-            generated_char, state = self._session.run(
-                [self._generated_symbols, self._generated_state],
-                feed_dict={self._in_temperature: 0.5,
-                           self._in_generation_data: encoded_char,
-                           self._in_generation_state: state,
-                           self._in_lstm_dropout: 0.0}
-            )
-            state = np.array(state)
-            if i >= len(tune_text):
-                generated_text += decode_tune_matrix(generated_char,
-                                                     self._decoder)
-        return tune_text + generated_text
-
-    def close(self):
-        self._session.close()
+        generated_logits = tf.get_collection(cls.GENERATED_LOGITS)
+        if generated_logits:
+            return generated_logits[0]
+        op = tf.get_collection(cls.GENERATED_SYMBOLS)[0].op
+        while op.type != "Multinomial":
+            op = op.inputs[0].op
+        return op.inputs[0].op.inputs[0]
 
-    def _get_generated_state(self):
-        """ LSTM state collection needs to be read in a special way. """
+    @classmethod
+    def find_generated_state(cls):
+        """
+        Find output lstm state of the generation graph in the default graph.
+        LSTM state collection needs to be read in a special way.
+        """
         states = []
-        state_collection = tf.get_collection(self.GENERATED_STATE)
+        state_collection = tf.get_collection(cls.GENERATED_STATE)
         for i in range(0, len(state_collection), 2):
             states.append(
                 tf.nn.rnn_cell.LSTMStateTuple(state_collection[i],
                                               state_collection[i + 1])
             )
-        self._generated_state = tuple(states)
+        return tuple(states)
+
+    def close(self):
+        self._session.close()
+
+    def _create_state_matrix(self, batch_size):
+        """ Create zero lstm state for batch_size generated tunes. """
+        return np.zeros([len(self._generated_state), 2, batch_size,
+                         self._generated_state[0].c.shape.as_list()[-1]])
+
+    def _get_roll_out(self):
+        """ Get roll out of the training graph, if it is available. """
+        if self._rolled_out_logits is None:
+            return super()._get_roll_out()
+        return self._in_data.shape.as_list()[0]
+
+    def _run_window(self, in_indices, state):
+        """ Run training graph roll out over the window of symbols. """
+        if self._rolled_out_logits is None:
+            return super()._run_window(in_indices, state)
+        with measure(self._profiler, "compute"):
+            logits, state = self._session.run(
+                [self._rolled_out_logits, self._rolled_out_state],
+                feed_dict={self._in_data: in_indices, self._in_state: state,
+                           self._in_lstm_dropout: 0.0}
+            )
+        return logits, state
 
-    def _load_encoding(self, encoder_file_path, decoder_file_path):
-        """ Load encoder and decoder from provided file paths. """
-        with open(encoder_file_path, "rb") as file:
-            self._encoder = pickle.load(file)
-        with open(decoder_file_path, "rb") as file:
-            self._decoder = pickle.load(file)
+    def _run_step(self, in_indices, state, with_logits):
+        """ Run single generation graph step. """
+        in_chars = np.zeros([len(in_indices), len(self._codec)])
+        is_fed = in_indices >= 0
+        in_chars[is_fed, in_indices[is_fed]] = 1.0
+        nodes_to_run = [self._generated_state]
+        feed_dict = {self._in_generation_data: in_chars,
+                     self._in_generation_state: state,
+                     self._in_lstm_dropout: 0.0}
+        if with_logits:
+            nodes_to_run.append(self._generated_logits)
+        with measure(self._profiler, "compute"):
+            output = self._session.run(nodes_to_run, feed_dict=feed_dict)
+        with measure(self._profiler, "state"):
+            state = np.array(output[0])
+        logits = output[1] if with_logits else None
+        return logits, state
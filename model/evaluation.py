@@ -0,0 +1,76 @@
+"""
+This module contains evaluator, which validates training checkpoints in a
+separate process, so that training isn't stalled by validation runs.
+"""
+
+
+import multiprocessing
+import queue
+
+
+__all__ = ["AsyncEvaluator"]
+
+
+class AsyncEvaluator:
+    """
+    This class describes evaluator process, which runs full validation of
+    the latest requested checkpoint, writes validation summaries and saves
+    the best model. Older requests, which wait behind newer ones, are skipped.
+    """
+
+    def __init__(self, build_params, val_root, checkpoints_root,
+                 best_model_root, dataset, batch_size):
+        # Tensorflow doesn't support forking, so the process is spawned.
+        context = multiprocessing.get_context("spawn")
+        self._requests = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(
+            target=_run_evaluator,
+            args=[build_params, val_root, checkpoints_root, best_model_root,
+                  dataset, batch_size, self._requests, self._results],
+            daemon=True
+        )
+        self._process.start()
+
+    def evaluate(self, iteration, checkpoint_path):
+        """ Request validation of checkpoint saved at given iteration. """
+        self._requests.put((iteration, checkpoint_path))
+
+    def get_results(self):
+        """
+        Get list of pairs of iterations and validation losses of checkpoints
+        evaluated since the last call.
+        """
+        results = []
+        while True:
+            try:
+                result = self._results.get_nowait()
+            except queue.Empty:
+                return results
+            if isinstance(result, Exception):
+                raise result
+            results.append(result)
+
+    def close(self):
+        """
+        Wait for evaluation of the latest requested checkpoint and stop the
+        process. Return results, which weren't get yet.
+        """
+        self._requests.put(None)
+        self._process.join()
+        return self.get_results()
+
+
+def _run_evaluator(build_params, val_root, checkpoints_root, best_model_root,
+                   dataset, batch_size, requests, results):
+    """ Evaluate requested checkpoints until stopped. """
+    # Model module is imported here, because it imports this one.
+    from model.basic_model import BasicModel
+    try:
+        # Evaluator has no train runs, so its train writer is placed among
+        # validation logs.
+        model = BasicModel(build_params, val_root, val_root,
+                           checkpoints_root, best_model_root)
+        model.evaluate_checkpoints(dataset, batch_size, requests, results)
+    except Exception as error:
+        results.put(error)
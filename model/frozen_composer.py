@@ -0,0 +1,199 @@
+"""
+This module contains export of the generation subgraph of a trained model to
+a frozen, optionally weight quantized graph and composer, which runs it.
+"""
+
+
+import numpy as np
+import tensorflow as tf
+from tensorflow.python.framework import meta_graph, tensor_util
+
+from model.base_composer import BaseComposer
+from model.composer import Composer
+from model.numpy_composer import LSTM_VARIABLE_PATTERN, OUT_VARIABLE_PATTERN
+from model.profiling import measure
+from model.sampling import log_softmax
+
+
+__all__ = ["FrozenComposer", "export_frozen_model", "measure_drift"]
+
+
+# Names of input and output nodes of frozen graphs.
+FROZEN_IN_DATA = "in_data"
+FROZEN_IN_STATE = "in_state"
+FROZEN_LOGITS = "generated_logits"
+FROZEN_STATE = "generated_state"
+QUANTIZATION_LEVELS = 127
+
+
+def export_frozen_model(model_file_path, meta_file_path, frozen_file_path,
+                        quantize=False):
+    """
+    Save generation subgraph of the model with its variables turned into
+    constants as a single GraphDef file. Optimizer, summary and training
+    nodes are dropped and dropout is fixed to zero. If quantize is set, lstm
+    kernels and output layer weights are stored as int8 with float scale of
+    every output column.
+    """
+    meta_graph_def = meta_graph.read_meta_graph_file(meta_file_path)
+    with tf.Graph().as_default() as graph, tf.Session() as session:
+        input_map = {
+            _get_collection_name(meta_graph_def, Composer.IN_GENERATION_DATA):
+                _create_input(meta_graph_def, Composer.IN_GENERATION_DATA,
+                              FROZEN_IN_DATA),
+            _get_collection_name(meta_graph_def, Composer.IN_GENERATION_STATE):
+                _create_input(meta_graph_def, Composer.IN_GENERATION_STATE,
+                              FROZEN_IN_STATE),
+            _get_collection_name(meta_graph_def, Composer.IN_LSTM_DROPOUT):
+                tf.constant(0.0)
+        }
+        saver = tf.train.import_meta_graph(meta_graph_def,
+                                           input_map=input_map)
+        saver.restore(session, model_file_path)
+        tf.identity(Composer.find_generated_logits(), name=FROZEN_LOGITS)
+        tf.stack([tf.stack(layer_state)
+                  for layer_state in Composer.find_generated_state()],
+                 name=FROZEN_STATE)
+        graph_def = tf.graph_util.convert_variables_to_constants(
+            session, graph.as_graph_def(), [FROZEN_LOGITS, FROZEN_STATE]
+        )
+    if quantize:
+        graph_def = _quantize_weights(graph_def)
+    with open(frozen_file_path, "wb") as file:
+        file.write(graph_def.SerializeToString())
+
+
+def measure_drift(reference, candidate, tune_text):
+    """
+    Compare next symbol predictions of candidate composer with the reference
+    one over tune text. Return dictionary with maximal difference of log
+    probabilities, mean Kullback-Leibler divergence of predicted
+    distributions, agreement of the most probable symbols and accuracies of
+    both composers.
+    """
+    reference_log_probabilities = log_softmax(reference.read_logits(tune_text))
+    candidate_log_probabilities = log_softmax(candidate.read_logits(tune_text))
+    targets = reference.encode(tune_text)
+    reference_predictions = reference_log_probabilities.argmax(axis=1)
+    candidate_predictions = candidate_log_probabilities.argmax(axis=1)
+    divergences = np.sum(
+        np.exp(reference_log_probabilities)
+        * (reference_log_probabilities - candidate_log_probabilities), axis=1
+    )
+    return {
+        "max_log_probability_difference": float(np.abs(
+            reference_log_probabilities - candidate_log_probabilities
+        ).max()),
+        "mean_kl_divergence": float(divergences.mean()),
+        "top1_agreement": float(np.mean(reference_predictions
+                                        == candidate_predictions)),
+        "reference_accuracy": float(np.mean(reference_predictions == targets)),
+        "candidate_accuracy": float(np.mean(candidate_predictions == targets))
+    }
+
+
+class FrozenComposer(BaseComposer):
+    """
+    This class describes composer, which runs frozen generation graph saved
+    with export_frozen_model.
+    """
+
+    def __init__(self, frozen_file_path, codec_file_path, state_cache=None,
+                 seed=None, instrumentation=None):
+        """ Load frozen graph and codec. """
+        super().__init__(codec_file_path, state_cache, seed, instrumentation)
+        graph_def = tf.GraphDef()
+        with open(frozen_file_path, "rb") as file:
+            graph_def.ParseFromString(file.read())
+        graph = tf.Graph()
+        with graph.as_default():
+            tf.import_graph_def(graph_def, name="")
+        self._session = tf.Session(graph=graph)
+        self._in_data = graph.get_tensor_by_name(FROZEN_IN_DATA + ":0")
+        self._in_state = graph.get_tensor_by_name(FROZEN_IN_STATE + ":0")
+        self._generated_logits = graph.get_tensor_by_name(FROZEN_LOGITS + ":0")
+        self._generated_state = graph.get_tensor_by_name(FROZEN_STATE + ":0")
+
+    def close(self):
+        self._session.close()
+
+    def _create_state_matrix(self, batch_size):
+        """ Create zero lstm state for batch_size generated tunes. """
+        state_shape = self._in_state.shape.as_list()
+        state_shape[2] = batch_size
+        return np.zeros(state_shape, dtype=np.float32)
+
+    def _run_step(self, in_indices, state, with_logits):
+        """ Run single frozen graph step. """
+        in_chars = np.zeros([len(in_indices), len(self._codec)],
+                            dtype=np.float32)
+        is_fed = in_indices >= 0
+        in_chars[is_fed, in_indices[is_fed]] = 1.0
+        nodes_to_run = [self._generated_state]
+        if with_logits:
+            nodes_to_run.append(self._generated_logits)
+        with measure(self._profiler, "compute"):
+            output = self._session.run(
+                nodes_to_run,
+                feed_dict={self._in_data: in_chars, self._in_state: state}
+            )
+        logits = output[1] if with_logits else None
+        return logits, output[0]
+
+
+def _get_collection_name(meta_graph_def, collection):
+    """ Get name of the first tensor in collection of the meta graph. """
+    return meta_graph_def.collection_def[collection].node_list.value[0]
+
+
+def _create_input(meta_graph_def, collection, name):
+    """
+    Create placeholder with given name, which replaces placeholder from
+    collection of the meta graph, with the same type and shape.
+    """
+    node_name = _get_collection_name(meta_graph_def, collection).split(":")[0]
+    node = next(node for node in meta_graph_def.graph_def.node
+                if node.name == node_name)
+    return tf.placeholder(tf.as_dtype(node.attr["dtype"].type),
+                          tf.TensorShape(node.attr["shape"].shape), name=name)
+
+
+def _quantize_weights(graph_def):
+    """
+    Replace constants of lstm kernels and output layer weights with int8
+    constants and float scales, which are multiplied back on use.
+    """
+    dequantized_weights = {}
+    with tf.Graph().as_default() as graph:
+        for node in graph_def.node:
+            if not _is_quantized(node):
+                continue
+            weights = tensor_util.MakeNdarray(node.attr["value"].tensor)
+            scales = (np.abs(weights).max(axis=0, keepdims=True)
+                      / QUANTIZATION_LEVELS)
+            scales[scales == 0.0] = 1.0
+            quantized_weights = np.round(weights / scales).astype(np.int8)
+            dequantized_weights[node.name + ":0"] = tf.multiply(
+                tf.cast(tf.constant(quantized_weights,
+                                    name=node.name + "_quantized"),
+                        tf.float32),
+                tf.constant(scales.astype(np.float32),
+                            name=node.name + "_scales"),
+                name=node.name + "_dequantized"
+            )
+        tf.import_graph_def(graph_def, input_map=dequantized_weights, name="")
+    # Float constants aren't used anymore, so they are dropped.
+    return tf.graph_util.extract_sub_graph(graph.as_graph_def(),
+                                           [FROZEN_LOGITS, FROZEN_STATE])
+
+
+def _is_quantized(node):
+    """ Check, if node is a constant of weights, which are quantized. """
+    if node.op != "Const":
+        return False
+    lstm_match = LSTM_VARIABLE_PATTERN.search(node.name)
+    is_lstm_kernel = (lstm_match is not None
+                      and lstm_match.group(2) in ["kernel", "weights"])
+    out_match = OUT_VARIABLE_PATTERN.search(node.name)
+    is_out_weights = out_match is not None and out_match.group(1) == "weights"
+    return is_lstm_kernel or is_out_weights
@@ -0,0 +1,163 @@
+"""
+This module contains composer which runs trained model with numpy only, so
+tensorflow is needed just once to export weights from the checkpoint.
+"""
+
+
+import re
+
+import numpy as np
+
+from model.base_composer import BaseComposer
+
+
+__all__ = ["NumpyComposer", "export_weights", "check_parity"]
+
+
+# Patterns of checkpoint variable names of lstm layers and the output layer.
+LSTM_VARIABLE_PATTERN = re.compile(
+    r"cell_(\d+)/[^/]*lstm[^/]*/(kernel|bias|weights|biases)$"
+)
+OUT_VARIABLE_PATTERN = re.compile(r"^out/(weights|biases)$")
+# Absolute tolerances of the numpy model against the tensorflow graph, which
+# differ only in rounding of float32 operations.
+STATE_TOLERANCE = 1e-4
+LOGITS_TOLERANCE = 1e-3
+PARITY_TUNE = "~e3d efg2|~e3f gedB|~e3d efg2|G2AB gedB|\n"
+
+
+def export_weights(model_file_path, weights_file_path):
+    """
+    Read lstm stack and output layer weights from the tensorflow checkpoint
+    and save them in the .npz file used by NumpyComposer.
+    """
+    # Tensorflow is imported here, so that NumpyComposer doesn't depend on it.
+    import tensorflow as tf
+    reader = tf.train.NewCheckpointReader(model_file_path)
+    weights = {}
+    for name in reader.get_variable_to_shape_map():
+        lstm_match = LSTM_VARIABLE_PATTERN.search(name)
+        out_match = OUT_VARIABLE_PATTERN.search(name)
+        if lstm_match is not None:
+            layer, kind = lstm_match.groups()
+            kind = "kernel" if kind in ["kernel", "weights"] else "bias"
+            weights["{}_{}".format(kind, layer)] = reader.get_tensor(name)
+        elif out_match is not None:
+            weights["out_" + out_match.group(1)] = reader.get_tensor(name)
+    np.savez(weights_file_path, **weights)
+
+
+def check_parity(composer, numpy_composer, tune_text=PARITY_TUNE):
+    """
+    Check, that numpy composer reproduces lstm state and output logits of
+    the tensorflow composer after reading tune text, and raise AssertionError
+    otherwise.
+    """
+    np.testing.assert_allclose(
+        numpy_composer.read_state(tune_text), composer.read_state(tune_text),
+        rtol=0, atol=STATE_TOLERANCE,
+        err_msg="Numpy model state differs from the tensorflow graph."
+    )
+    np.testing.assert_allclose(
+        numpy_composer.read_logits(tune_text),
+        composer.read_logits(tune_text), rtol=0, atol=LOGITS_TOLERANCE,
+        err_msg="Numpy model logits differ from the tensorflow graph."
+    )
+
+
+class NumpyComposer(BaseComposer):
+    """
+    This class describes composer, which runs the lstm stack and the output
+    layer of the trained model in preallocated numpy buffers.
+    """
+
+    def __init__(self, weights_file_path, codec_file_path, seed=None,
+                 state_cache=None, instrumentation=None):
+        """ Load weights and codec. """
+        super().__init__(codec_file_path, state_cache, seed, instrumentation)
+        self._load_weights(weights_file_path)
+        self._batch_size = None
+
+    def _create_state_matrix(self, batch_size):
+        """ Create zero lstm state for batch_size generated tunes. """
+        return np.zeros([self._layers_count, 2, batch_size, self._layers_size],
+                        dtype=np.float32)
+
+    def _run_step(self, in_indices, state, with_logits):
+        """
+        Run single lstm step. State is updated in place and returned with
+        logits computed into the preallocated buffer.
+        """
+        self._create_buffers(len(in_indices))
+        gates = self._gates
+        for i in range(self._layers_count):
+            c, h = state[i]
+            if i == 0:
+                # Input of the first layer is one-hot, so its product with the
+                # kernel is a row lookup. Index -1 selects the bias only row.
+                np.take(self._in_table, in_indices, axis=0, out=gates)
+            else:
+                np.dot(state[i - 1, 1], self._in_kernels[i], out=gates)
+                gates += self._biases[i]
+            gates += np.dot(h, self._state_kernels[i], out=self._state_gates)
+            in_gate, new_input, forget_gate, out_gate = self._gates_views
+            _sigmoid(in_gate)
+            np.tanh(new_input, out=new_input)
+            _sigmoid(forget_gate)
+            _sigmoid(out_gate)
+            c *= forget_gate
+            in_gate *= new_input
+            c += in_gate
+            np.tanh(c, out=h)
+            h *= out_gate
+        if not with_logits:
+            return None, state
+        np.dot(state[-1, 1], self._out_weights, out=self._logits)
+        self._logits += self._out_biases
+        return self._logits, state
+
+    def _create_buffers(self, batch_size):
+        """ Allocate step buffers, if batch size has changed. """
+        if batch_size == self._batch_size:
+            return
+        self._batch_size = batch_size
+        self._gates = np.zeros([batch_size, 4 * self._layers_size],
+                               dtype=np.float32)
+        self._state_gates = np.zeros_like(self._gates)
+        self._gates_views = np.split(self._gates, 4, axis=1)
+        self._logits = np.zeros([batch_size, self._out_weights.shape[1]],
+                                dtype=np.float32)
+
+    def _load_weights(self, weights_file_path):
+        """
+        Load exported weights and split lstm kernels into the input and the
+        state parts.
+        """
+        with np.load(weights_file_path) as weights:
+            self._layers_count = len([name for name in weights.files
+                                      if name.startswith("kernel_")])
+            self._layers_size = weights["bias_0"].shape[-1] // 4
+            self._in_kernels = []
+            self._state_kernels = []
+            self._biases = []
+            for i in range(self._layers_count):
+                kernel = weights["kernel_{}".format(i)].astype(np.float32)
+                bias = weights["bias_{}".format(i)].astype(np.float32)
+                # Forget gate bias of 1.0 is added by BasicLSTMCell on the fly.
+                bias[2 * self._layers_size:3 * self._layers_size] += 1.0
+                self._in_kernels.append(kernel[:-self._layers_size])
+                self._state_kernels.append(kernel[-self._layers_size:])
+                self._biases.append(bias)
+            self._out_weights = weights["out_weights"].astype(np.float32)
+            self._out_biases = weights["out_biases"].astype(np.float32)
+        self._in_table = np.concatenate(
+            [self._in_kernels[0] + self._biases[0], self._biases[0][None]]
+        )
+
+
+def _sigmoid(x):
+    """ Compute logistic sigmoid of x in place. """
+    x *= 0.5
+    np.tanh(x, out=x)
+    x *= 0.5
+    x += 0.5
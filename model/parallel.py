@@ -0,0 +1,249 @@
+"""
+This module contains data parallel training, where worker processes train
+model replicas on shards of the train set and average their gradients after
+every step.
+"""
+
+
+import multiprocessing
+import os
+import tempfile
+import time
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from model.basic_model import BasicModel
+from processing.dataset import Dataset
+
+
+__all__ = ["GradientAverager", "train_parallel", "measure_scaling"]
+
+
+class GradientAverager:
+    """
+    This class describes synchronous averaging of flat float32 vectors between
+    workers. Worker of rank 0 is the chief, which listens on the address,
+    sums vectors received from all other workers and sends their mean back.
+    Address is a (host, port) pair, which works across nodes of one network,
+    or a path of unix socket for workers on a single node.
+    """
+
+    # Time in seconds, for which workers try to connect to the chief.
+    CONNECT_TIMEOUT = 60.0
+    CONNECT_RETRY_INTERVAL = 0.1
+
+    def __init__(self, address, rank, workers_count, authkey=b"bucketnet"):
+        self._rank = rank
+        self._workers_count = workers_count
+        self._connections = []
+        self._buffer = None
+        if self.is_chief():
+            self._accept_workers(address, authkey)
+        else:
+            self._connect_to_chief(address, authkey)
+
+    def is_chief(self):
+        """ Check, if this worker is the chief. """
+        return self._rank == 0
+
+    def average(self, vector):
+        """ Return mean of vectors passed by all workers. """
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        if self._buffer is None or self._buffer.shape != vector.shape:
+            self._buffer = np.empty_like(vector)
+        mean = vector.copy()
+        if not self.is_chief():
+            self._connections[0].send_bytes(vector)
+            self._connections[0].recv_bytes_into(mean)
+            return mean
+        # Vectors are received into the preallocated buffer without copies.
+        for connection in self._connections:
+            connection.recv_bytes_into(self._buffer)
+            mean += self._buffer
+        mean /= self._workers_count
+        for connection in self._connections:
+            connection.send_bytes(mean)
+        return mean
+
+    def broadcast(self, vector):
+        """ Return vector passed by the chief. """
+        vector = np.ascontiguousarray(vector, dtype=np.float32)
+        if not self.is_chief():
+            self._connections[0].recv_bytes_into(vector)
+            return vector
+        for connection in self._connections:
+            connection.send_bytes(vector)
+        return vector
+
+    def any(self, flag):
+        """ Return True, if flag passed by any of workers is True. """
+        if not self.is_chief():
+            self._connections[0].send(bool(flag))
+            return self._connections[0].recv()
+        flag = bool(flag)
+        for connection in self._connections:
+            flag = connection.recv() or flag
+        for connection in self._connections:
+            connection.send(flag)
+        return flag
+
+    def close(self):
+        """ Close connections to other workers. """
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+    def _accept_workers(self, address, authkey):
+        """ Wait for all other workers and order them by their ranks. """
+        connections = [None] * (self._workers_count - 1)
+        with Listener(address, authkey=authkey) as listener:
+            for _ in range(self._workers_count - 1):
+                connection = listener.accept()
+                connections[connection.recv() - 1] = connection
+        self._connections = connections
+
+    def _connect_to_chief(self, address, authkey):
+        """ Connect to the chief, which may not be listening yet. """
+        deadline = time.monotonic() + self.CONNECT_TIMEOUT
+        while True:
+            try:
+                connection = Client(address, authkey=authkey)
+                break
+            except (ConnectionRefusedError, FileNotFoundError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(self.CONNECT_RETRY_INTERVAL)
+        connection.send(self._rank)
+        self._connections = [connection]
+
+
+def train_parallel(workers_count, address, dataset_params, build_params,
+                   roots, train_params, first_rank=0,
+                   local_workers_count=None):
+    """
+    Train model with workers_count data parallel workers and return the final
+    test loss and accuracy. local_workers_count workers with ranks starting
+    from first_rank are started on this node, so training on several nodes
+    runs this function on each of them with their own ranks. roots are
+    train, validation, checkpoints and best model roots of BasicModel.
+    Returns None for nodes without the chief.
+    """
+    if local_workers_count is None:
+        local_workers_count = workers_count - first_rank
+    results = _run_workers(
+        _train_worker, range(first_rank, first_rank + local_workers_count),
+        workers_count, address, dataset_params, build_params, roots,
+        train_params
+    )
+    return results.get(0)
+
+
+def measure_scaling(workers_counts, address, dataset_params, build_params,
+                    steps_count=50, learning_rate=0.001):
+    """
+    Measure training throughput on this node for every workers count in
+    workers_counts. Return list of pairs of workers count and training
+    sequences processed per second by all workers.
+    """
+    scaling = []
+    for workers_count in workers_counts:
+        with tempfile.TemporaryDirectory() as logs_root:
+            roots = [os.path.join(logs_root, name) for name
+                     in ["train", "validation", "checkpoints", "best_model"]]
+            results = _run_workers(
+                _measure_worker, range(workers_count), workers_count, address,
+                dataset_params, build_params, roots,
+                {"steps_count": steps_count, "learning_rate": learning_rate}
+            )
+        scaling.append((workers_count, sum(results.values())))
+    return scaling
+
+
+def _run_workers(target, ranks, workers_count, address, dataset_params,
+                 build_params, roots, params):
+    """
+    Run target in a separate process for every rank and return dictionary of
+    their results keyed by ranks. Processes are spawned, because tensorflow
+    doesn't support forking.
+    """
+    context = multiprocessing.get_context("spawn")
+    results_queue = context.Queue()
+    threads_count = max(1, (os.cpu_count() or 1) // len(ranks))
+    processes = [
+        context.Process(target=target, args=[
+            rank, workers_count, address, dataset_params, build_params,
+            roots, params, threads_count, results_queue
+        ])
+        for rank in ranks
+    ]
+    for process in processes:
+        process.start()
+    results = {}
+    for _ in processes:
+        rank, result = results_queue.get()
+        if isinstance(result, Exception):
+            for process in processes:
+                process.terminate()
+            raise result
+        results[rank] = result
+    for process in processes:
+        process.join()
+    return results
+
+
+def _create_worker(rank, workers_count, address, dataset_params, build_params,
+                   roots, threads_count):
+    """
+    Create averager, dataset with train set shard and model of the worker.
+    Workers other than the chief log their training to their own directories.
+    """
+    averager = GradientAverager(address, rank, workers_count)
+    # All workers have to split tunes between subsets the same way.
+    dataset_params = dict(dataset_params)
+    dataset_params.setdefault("split_seed", 0)
+    dataset = Dataset(**dataset_params)
+    dataset.shard_train_set(rank, workers_count)
+    if rank != 0:
+        roots = [os.path.join(root, "worker_{}".format(rank))
+                 for root in roots]
+    # Only workers' graphs need nodes exchanging gradients and variables.
+    build_params = dict(build_params, data_parallel=True)
+    model = BasicModel(build_params, *roots, threads_count=threads_count)
+    return averager, dataset, model
+
+
+def _train_worker(rank, workers_count, address, dataset_params, build_params,
+                  roots, train_params, threads_count, results_queue):
+    """ Train single worker and put its result to the queue. """
+    try:
+        averager, dataset, model = _create_worker(
+            rank, workers_count, address, dataset_params, build_params, roots,
+            threads_count
+        )
+        result = model.train(dataset, averager=averager,
+                             batch_size=dataset_params["batch_size"],
+                             **train_params)
+        averager.close()
+    except Exception as error:
+        result = error
+    results_queue.put((rank, result))
+
+
+def _measure_worker(rank, workers_count, address, dataset_params,
+                    build_params, roots, measure_params, threads_count,
+                    results_queue):
+    """ Measure training speed of single worker and put it to the queue. """
+    try:
+        averager, dataset, model = _create_worker(
+            rank, workers_count, address, dataset_params, build_params, roots,
+            threads_count
+        )
+        result = model.measure_training_speed(
+            dataset, batch_size=dataset_params["batch_size"],
+            averager=averager, **measure_params
+        )
+        averager.close()
+    except Exception as error:
+        result = error
+    results_queue.put((rank, result))
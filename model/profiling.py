@@ -0,0 +1,194 @@
+"""
+This module contains profilers, which time sections of training steps and
+generation, and opt-in instrumentation, which exports their statistics.
+"""
+
+
+import json
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+import numpy as np
+
+
+__all__ = ["StepProfiler", "Instrumentation", "measure"]
+
+
+def measure(profiler, section):
+    """
+    Measure duration of the enclosed code as part of section with profiler,
+    or do nothing, if profiler is None.
+    """
+    if profiler is None:
+        return nullcontext()
+    return profiler.measure(section)
+
+
+class StepProfiler:
+    """
+    This class describes profiler, which collects durations of named sections
+    of training steps: batch assembly, feeding, graph computation, which
+    includes transfer of the host state, resets of state rows and summary
+    output.
+    """
+
+    SECTIONS = ["batch", "feed", "compute", "state_reset", "summary"]
+
+    def __init__(self):
+        self._durations = defaultdict(list)
+
+    @contextmanager
+    def measure(self, section):
+        """ Measure duration of the enclosed code as part of section. """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._durations[section].append(time.perf_counter() - start)
+
+    def count(self, counter, value=1):
+        """ Counters are ignored by the step profiler. """
+
+    def should_trace(self):
+        """ Step profiler never requests traces. """
+        return False
+
+    def maybe_export(self, step, writer=None):
+        """ Step profiler keeps all durations until it is reset. """
+
+    def get_breakdown(self):
+        """
+        Get dictionary mapping measured sections to their count, total and
+        mean durations in seconds. Sections are ordered as in SECTIONS,
+        followed by other ones sorted by name, so that saved results compare
+        across versions.
+        """
+        sections = ([section for section in self.SECTIONS
+                     if section in self._durations]
+                    + sorted(set(self._durations) - set(self.SECTIONS)))
+        return {section: {"count": len(self._durations[section]),
+                          "total": float(np.sum(self._durations[section])),
+                          "mean": float(np.mean(self._durations[section]))}
+                for section in sections}
+
+    def reset(self):
+        """ Drop all measured durations. """
+        self._durations.clear()
+
+
+class Instrumentation(StepProfiler):
+    """
+    This class describes instrumentation of training and generation hot
+    paths. Besides durations it collects counters and, every export_interval
+    seconds, exports durations percentiles and histograms to a tensorboard
+    writer and as json lines to the metrics file. Every trace_interval-th
+    step is traced with tensorflow RunMetadata, if trace_interval is given.
+    Instrumentation can be enabled without code changes with BUCKETNET_METRICS
+    environment variable set to the metrics file path.
+    """
+
+    PERCENTILES = [50, 95, 99]
+    HISTOGRAM_BINS = 30
+
+    def __init__(self, metrics_file_path=None, export_interval=60.0,
+                 trace_interval=None):
+        super().__init__()
+        self._metrics_file_path = metrics_file_path
+        self._export_interval = export_interval
+        self._trace_interval = trace_interval
+        self._counters = defaultdict(int)
+        self._traced_count = 0
+        self._last_export = time.monotonic()
+
+    @classmethod
+    def from_environment(cls):
+        """
+        Create instrumentation configured by BUCKETNET_METRICS,
+        BUCKETNET_METRICS_INTERVAL and BUCKETNET_TRACE_INTERVAL environment
+        variables, or return None, if metrics file path isn't set.
+        """
+        metrics_file_path = os.environ.get("BUCKETNET_METRICS")
+        if not metrics_file_path:
+            return None
+        trace_interval = os.environ.get("BUCKETNET_TRACE_INTERVAL")
+        return cls(metrics_file_path,
+                   float(os.environ.get("BUCKETNET_METRICS_INTERVAL", 60.0)),
+                   int(trace_interval) if trace_interval else None)
+
+    def count(self, counter, value=1):
+        """ Add value to the counter. """
+        self._counters[counter] += value
+
+    def should_trace(self):
+        """ Check, if the next step should be traced. """
+        if self._trace_interval is None:
+            return False
+        self._traced_count += 1
+        return self._traced_count % self._trace_interval == 0
+
+    def get_statistics(self):
+        """
+        Get dictionary with count, mean and percentiles of durations of every
+        section in milliseconds and with counters values.
+        """
+        timers = {}
+        for section, durations in self._durations.items():
+            durations_ms = np.array(durations) * 1000
+            timers[section] = {"count": len(durations_ms),
+                               "mean": float(durations_ms.mean())}
+            for percentile, value in zip(
+                    self.PERCENTILES,
+                    np.percentile(durations_ms, self.PERCENTILES)):
+                timers[section]["p{}".format(percentile)] = float(value)
+        return {"timers": timers, "counters": dict(self._counters)}
+
+    def maybe_export(self, step, writer=None):
+        """ Export statistics, if export interval has passed. """
+        if time.monotonic() - self._last_export >= self._export_interval:
+            self.export(step, writer)
+
+    def export(self, step, writer=None):
+        """
+        Export statistics gathered since the last export to the writer, if it
+        is given, and to the metrics file, and start gathering anew.
+        """
+        statistics = self.get_statistics()
+        if writer is not None:
+            writer.add_summary(self._create_summary(statistics),
+                               global_step=step)
+        if self._metrics_file_path is not None:
+            with open(self._metrics_file_path, "a") as file:
+                file.write(json.dumps(dict(statistics, step=step,
+                                           time=time.time())) + "\n")
+        self.reset()
+        self._counters.clear()
+        self._last_export = time.monotonic()
+
+    def _create_summary(self, statistics):
+        """ Create tensorboard summary of durations and counters. """
+        # Tensorflow is imported here, so that numpy composer can be
+        # instrumented without it.
+        import tensorflow as tf
+        values = []
+        for section, durations in self._durations.items():
+            durations_ms = np.array(durations) * 1000
+            counts, limits = np.histogram(durations_ms, self.HISTOGRAM_BINS)
+            histogram = tf.HistogramProto(
+                min=durations_ms.min(), max=durations_ms.max(),
+                num=len(durations_ms), sum=durations_ms.sum(),
+                sum_squares=np.square(durations_ms).sum(),
+                bucket_limit=limits[1:].tolist(), bucket=counts.tolist()
+            )
+            values.append(tf.Summary.Value(tag="timers/" + section,
+                                           histo=histogram))
+            for name, value in statistics["timers"][section].items():
+                values.append(tf.Summary.Value(
+                    tag="timers/{}/{}".format(section, name),
+                    simple_value=value
+                ))
+        for counter, value in statistics["counters"].items():
+            values.append(tf.Summary.Value(tag="counters/" + counter,
+                                           simple_value=value))
+        return tf.Summary(value=values)
@@ -0,0 +1,43 @@
+""" This module provides functions which sample symbols from model's logits. """
+
+
+import numpy as np
+
+
+__all__ = ["log_softmax", "sample"]
+
+
+def log_softmax(logits):
+    """ Compute log-probabilities from logits over the last axis. """
+    shifted_logits = logits - logits.max(axis=-1, keepdims=True)
+    return shifted_logits - np.log(np.exp(shifted_logits).sum(axis=-1,
+                                                              keepdims=True))
+
+
+def sample(logits, random, temperature=1.0, top_k=None, top_p=None):
+    """
+    Sample one symbol index for every row of [batch, charset] logits, which
+    are overwritten in the process. With top_k only the top_k most probable
+    symbols are sampled from and with top_p only the smallest set of the most
+    probable symbols with total probability of at least top_p.
+    """
+    logits /= temperature
+    if top_k is not None and top_k < logits.shape[1]:
+        kth_logits = np.partition(logits, -top_k, axis=1)[:, -top_k]
+        logits[logits < kth_logits[:, np.newaxis]] = -np.inf
+    logits -= logits.max(axis=1, keepdims=True)
+    np.exp(logits, out=logits)
+    if top_p is not None and top_p < 1.0:
+        logits /= logits.sum(axis=1, keepdims=True)
+        order = np.argsort(-logits, axis=1)
+        sorted_probabilities = np.take_along_axis(logits, order, axis=1)
+        # Symbol is kept, if probability of more probable symbols is below
+        # top_p, so the most probable one is always kept.
+        is_dropped = (np.cumsum(sorted_probabilities, axis=1)
+                      - sorted_probabilities) >= top_p
+        np.put_along_axis(logits, order,
+                          np.where(is_dropped, 0.0, sorted_probabilities),
+                          axis=1)
+    np.cumsum(logits, axis=1, out=logits)
+    thresholds = random.random_sample(len(logits)) * logits[:, -1]
+    return np.sum(logits < thresholds[:, np.newaxis], axis=1)
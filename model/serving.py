@@ -0,0 +1,181 @@
+"""
+This module contains scheduler, which serves concurrent composition requests
+with continuous batching of their lstm steps.
+"""
+
+
+import asyncio
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+
+class _Sequence:
+    """ This class describes single composition request being served. """
+
+    def __init__(self, tune_text, prompt, generation_length, terminator,
+                 future):
+        self.tune_text = tune_text
+        self.future = future
+        self._prompt = prompt
+        self._generation_length = generation_length
+        self._terminator = terminator
+        self._position = 0
+        self._generated = []
+        self._generated_tail = ""
+
+    def get_next_input(self):
+        """ Get symbol index fed to the model in the next step. """
+        if self._position < len(self._prompt):
+            return self._prompt[self._position]
+        return self._generated[-1] if self._generated else -1
+
+    def is_sampling(self):
+        """ Check, if the next step samples a symbol for this sequence. """
+        return self._position >= len(self._prompt) - 1
+
+    def advance(self, generated_index, generated_char):
+        """ Record results of a step and return True, if sequence is done. """
+        is_sampling = self.is_sampling()
+        self._position += 1
+        if not is_sampling:
+            return False
+        self._generated.append(generated_index)
+        if self._terminator:
+            self._generated_tail = ((self._generated_tail + generated_char)
+                                    [-len(self._terminator):])
+            if self._generated_tail == self._terminator:
+                return True
+        return len(self._generated) >= self._generation_length
+
+    def get_generated(self):
+        """ Get indices of symbols generated so far. """
+        return self._generated
+
+
+class CompositionScheduler:
+    """
+    This class describes scheduler, which merges all active sequences into one
+    batched composer step per tick. Finished sequences free their rows and
+    waiting requests join at the next step. Steps run in a separate thread,
+    so the event loop keeps accepting requests.
+    """
+
+    # Time window in seconds, over which tokens per second are measured.
+    METRICS_WINDOW = 10.0
+
+    def __init__(self, composer, max_batch_size=64, temperature=0.5,
+                 top_k=None, top_p=None):
+        self._composer = composer
+        self._max_batch_size = max_batch_size
+        self._temperature = temperature
+        self._top_k = top_k
+        self._top_p = top_p
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending = deque()
+        self._active = []
+        self._state = composer.create_state(0)
+        self._new_request = asyncio.Event()
+        self._generated_counts = deque()
+        self._served_count = 0
+
+    async def compose(self, tune_text, generation_length, terminator=None):
+        """
+        Queue composition request and return tune text with generation_length
+        new symbols appended, once they are generated.
+        """
+        prompt = self._composer.encode(tune_text)
+        if generation_length <= 0:
+            return tune_text
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_Sequence(tune_text, prompt, generation_length,
+                                       terminator, future))
+        self._new_request.set()
+        return await future
+
+    def get_metrics(self):
+        """ Get current queue depth, batch size and throughput. """
+        self._drop_old_counts(time.monotonic())
+        generated_count = sum(count for _, count in self._generated_counts)
+        return {"queue_depth": len(self._pending),
+                "active_sequences": len(self._active),
+                "served_requests": self._served_count,
+                "tokens_per_second": generated_count / self.METRICS_WINDOW}
+
+    async def run(self):
+        """ Run the scheduling loop forever. """
+        loop = asyncio.get_running_loop()
+        while True:
+            self._admit_pending()
+            if not self._active:
+                self._new_request.clear()
+                await self._new_request.wait()
+                continue
+            in_indices = np.array([sequence.get_next_input()
+                                   for sequence in self._active])
+            is_sampling = any(sequence.is_sampling()
+                              for sequence in self._active)
+            temperature = self._temperature if is_sampling else None
+            try:
+                generated_indices, self._state = await loop.run_in_executor(
+                    self._executor, self._composer.step, in_indices,
+                    self._state, temperature, self._top_k, self._top_p
+                )
+            except Exception as error:
+                self._fail_active(error)
+                continue
+            self._advance_active(generated_indices)
+
+    def _admit_pending(self):
+        """ Move waiting requests to free rows of the batch. """
+        admitted_count = min(len(self._pending),
+                             self._max_batch_size - len(self._active))
+        if admitted_count <= 0:
+            return
+        for _ in range(admitted_count):
+            self._active.append(self._pending.popleft())
+        self._state = np.concatenate(
+            [self._state, self._composer.create_state(admitted_count)], axis=2
+        )
+
+    def _advance_active(self, generated_indices):
+        """ Advance active sequences and release the finished ones. """
+        is_active = np.ones(len(self._active), dtype=bool)
+        generated_count = 0
+        for i, sequence in enumerate(self._active):
+            generated_index = generated_char = None
+            if sequence.is_sampling():
+                generated_index = generated_indices[i]
+                generated_char = self._composer.decode([generated_index])
+                generated_count += 1
+            if sequence.advance(generated_index, generated_char):
+                is_active[i] = False
+                self._served_count += 1
+                if not sequence.future.done():
+                    sequence.future.set_result(
+                        sequence.tune_text
+                        + self._composer.decode(sequence.get_generated())
+                    )
+        now = time.monotonic()
+        self._generated_counts.append((now, generated_count))
+        self._drop_old_counts(now)
+        if not is_active.all():
+            self._active = [sequence for sequence, active
+                            in zip(self._active, is_active) if active]
+            self._state = self._state[:, :, is_active]
+
+    def _fail_active(self, error):
+        """ Fail all active requests with given error. """
+        for sequence in self._active:
+            if not sequence.future.done():
+                sequence.future.set_exception(error)
+        self._active = []
+        self._state = self._composer.create_state(0)
+
+    def _drop_old_counts(self, now):
+        """ Drop generated tokens counts older than the metrics window. """
+        while (self._generated_counts
+               and self._generated_counts[0][0] < now - self.METRICS_WINDOW):
+            self._generated_counts.popleft()
@@ -0,0 +1,63 @@
+""" This module contains cache of lstm states reached after reading prompts. """
+
+
+from collections import Counter, OrderedDict
+
+import numpy as np
+
+
+class PrefixStateCache:
+    """
+    This class describes least recently used cache, which maps prompt prefixes
+    to lstm states of a single row in shape of [layers, 2, size] reached after
+    reading them. Cache is bounded by memory used by its states.
+    """
+
+    def __init__(self, max_bytes=64 * 2 ** 20):
+        self._max_bytes = max_bytes
+        self._states = OrderedDict()
+        self._bytes = 0
+        # Counts of cached prefixes of every length, used to look prefixes up
+        # from the longest one.
+        self._lengths = Counter()
+
+    def get_longest_prefix(self, text, max_length):
+        """
+        Find the longest cached prefix of text not longer than max_length.
+        Return its length and a copy of its state, or 0 and None if there is
+        no such prefix.
+        """
+        for length in sorted(self._lengths, reverse=True):
+            if length > max_length:
+                continue
+            state = self._states.get(text[:length])
+            if state is not None:
+                self._states.move_to_end(text[:length])
+                return length, state.copy()
+        return 0, None
+
+    def put(self, prefix, state):
+        """ Cache copy of the state reached after reading prefix. """
+        if prefix in self._states or state.nbytes > self._max_bytes:
+            return
+        self._states[prefix] = np.array(state)
+        self._bytes += state.nbytes
+        self._lengths[len(prefix)] += 1
+        while self._bytes > self._max_bytes:
+            evicted_prefix, evicted_state = self._states.popitem(last=False)
+            self._bytes -= evicted_state.nbytes
+            self._lengths[len(evicted_prefix)] -= 1
+            if self._lengths[len(evicted_prefix)] == 0:
+                del self._lengths[len(evicted_prefix)]
+
+    def save(self, file_path):
+        """ Save cached prefixes and states to .npz file. """
+        np.savez(file_path, prefixes=np.array(list(self._states), dtype=str),
+                 states=np.array(list(self._states.values())))
+
+    def load(self, file_path):
+        """ Add prefixes and states saved with save to the cache. """
+        with np.load(file_path) as cache_file:
+            for prefix, state in zip(cache_file["prefixes"],
+                                     cache_file["states"]):
+                self.put(str(prefix), state)
@@ -0,0 +1,178 @@
+"""
+This module contains hyperparameter sweep, which trains models with grid or
+random search configurations concurrently and stops trials lagging behind on
+validation loss.
+"""
+
+
+import itertools
+import multiprocessing
+import os
+import tempfile
+from os import path
+
+import numpy as np
+
+from processing.dataset import Dataset
+
+
+__all__ = ["BUILD_PARAMS", "DATASET_PARAMS", "MedianPruner", "create_trials",
+           "run_sweep"]
+
+
+# Searched parameters, which are passed to the model build or to the dataset.
+# Other ones are passed to BasicModel.train.
+BUILD_PARAMS = ["layers_count", "layers_size", "roll_out", "state_on_device",
+                "lstm_implementation"]
+DATASET_PARAMS = ["batch_size", "roll_out", "packing"]
+
+
+class MedianPruner:
+    """
+    This class describes pruning of sweep trials, which stops a trial, whose
+    best validation loss is worse than median of best losses, which other
+    trials had at the same iteration. Losses are kept in a dictionary shared
+    by all trials through multiprocessing manager. Trials aren't pruned before
+    warmup_iterations or until min_trials_count other trials have reported
+    loss for the iteration.
+    """
+
+    def __init__(self, losses, trial_index, warmup_iterations=2000,
+                 min_trials_count=3):
+        self._losses = losses
+        self._trial_index = trial_index
+        self._warmup_iterations = warmup_iterations
+        self._min_trials_count = min_trials_count
+        self._best_loss = np.inf
+        self._is_pruned = False
+
+    def should_prune(self, iteration, loss):
+        """
+        Report validation loss of the trial at iteration and check, if the
+        trial should be stopped.
+        """
+        self._best_loss = min(self._best_loss, float(loss))
+        self._losses[self._trial_index, iteration] = self._best_loss
+        if iteration < self._warmup_iterations:
+            return False
+        other_losses = [
+            best_loss for (trial_index, reported_iteration), best_loss
+            in self._losses.items()
+            if reported_iteration == iteration
+            and trial_index != self._trial_index
+        ]
+        if len(other_losses) < self._min_trials_count:
+            return False
+        if self._best_loss > np.median(other_losses):
+            self._is_pruned = True
+        return self._is_pruned
+
+    def get_best_loss(self):
+        """ Get the best validation loss reported by the trial. """
+        return self._best_loss
+
+    def is_pruned(self):
+        """ Check, if the trial was pruned. """
+        return self._is_pruned
+
+
+def create_trials(space, trials_count=None, seed=0):
+    """
+    Create list of trials parameters from search space, which maps parameters
+    names to lists of their values. Without trials_count, all combinations of
+    values form a grid. Otherwise trials_count trials are drawn at random,
+    where (low, high) tuples are sampled uniformly, as integers if both are
+    integers, and lists are sampled from.
+    """
+    names = sorted(space)
+    if trials_count is None:
+        return [dict(zip(names, values))
+                for values in itertools.product(*(space[name]
+                                                  for name in names))]
+    random = np.random.RandomState(seed)
+    trials = []
+    for _ in range(trials_count):
+        trial = {}
+        for name in names:
+            values = space[name]
+            if not isinstance(values, tuple):
+                trial[name] = values[random.randint(len(values))]
+            elif all(isinstance(value, int) for value in values):
+                trial[name] = int(random.randint(values[0], values[1] + 1))
+            else:
+                trial[name] = float(random.uniform(*values))
+        trials.append(trial)
+    return trials
+
+
+def run_sweep(trials, dataset_params, build_params, train_params, logs_root,
+              processes_count=None, warmup_iterations=2000,
+              min_trials_count=3):
+    """
+    Train model for every trial parameters in processes_count processes,
+    all available cpus by default, where every process uses its share of cpu
+    threads. Trials parameters override dataset, build and train parameters.
+    All trials memory map one corpus cache, which is built once up front, in
+    a temporary directory, if dataset_params have no cache_root. Trials are
+    stopped by MedianPruner. Return list of results in the order of trials.
+    """
+    processes_count = min(processes_count or os.cpu_count(), len(trials))
+    threads_count = max(1, os.cpu_count() // processes_count)
+    dataset_params = dict(dataset_params)
+    # Validation losses of all trials are comparable only on the same split.
+    dataset_params.setdefault("split_seed", 0)
+    with tempfile.TemporaryDirectory() as temp_cache_root:
+        if dataset_params.get("cache_root") is None:
+            dataset_params["cache_root"] = temp_cache_root
+        dataset = Dataset(**dataset_params)
+        os.makedirs(logs_root, exist_ok=True)
+        dataset.save_encoding(logs_root)
+        build_params = dict(build_params,
+                            charset_size=dataset.get_charset_size())
+        train_params = dict(train_params,
+                            batch_size=dataset_params["batch_size"],
+                            charset_size=dataset.get_charset_size())
+        # Processes are spawned, because tensorflow doesn't support forking,
+        # and every trial gets a fresh one, so that its graph is freed.
+        context = multiprocessing.get_context("spawn")
+        with context.Manager() as manager, \
+                context.Pool(processes_count, maxtasksperchild=1) as pool:
+            losses = manager.dict()
+            pending_results = [
+                pool.apply_async(_run_trial, [
+                    trial_index, trial, dataset_params, build_params,
+                    train_params, path.join(logs_root,
+                                            "trial_{}".format(trial_index)),
+                    threads_count, MedianPruner(losses, trial_index,
+                                                warmup_iterations,
+                                                min_trials_count)
+                ])
+                for trial_index, trial in enumerate(trials)
+            ]
+            return [result.get() for result in pending_results]
+
+
+def _run_trial(trial_index, trial, dataset_params, build_params,
+               train_params, logs_root, threads_count, pruner):
+    """ Train model of single trial and return its result. """
+    # Tensorflow is imported only in trial processes.
+    from model.basic_model import BasicModel
+    for name, value in trial.items():
+        if name in DATASET_PARAMS:
+            dataset_params = dict(dataset_params, **{name: value})
+        if name in BUILD_PARAMS:
+            build_params = dict(build_params, **{name: value})
+        if name not in BUILD_PARAMS + DATASET_PARAMS or name == "batch_size":
+            train_params = dict(train_params, **{name: value})
+    dataset = Dataset(**dataset_params)
+    model = BasicModel(build_params, *[
+        path.join(logs_root, name) for name
+        in ["train", "validation", "checkpoints", "best_model"]
+    ], threads_count=threads_count)
+    test_loss, test_accuracy = model.train(dataset, pruner=pruner,
+                                           **train_params)
+    return {"trial": trial_index, "params": trial,
+            "validation_loss": pruner.get_best_loss(),
+            "test_loss": float(test_loss),
+            "test_accuracy": float(test_accuracy),
+            "pruned": pruner.is_pruned()}
@@ -0,0 +1,15 @@
+""" Entry point for one-time preprocessing of the tunes corpus. """
+
+
+from processing.corpus_cache import build_corpus_cache
+
+
+def main():
+    cache_path = build_corpus_cache("data/dataset/tunes.csv",
+                                    {"tune_types": ["reel"]}, "data/cache",
+                                    deduplication={})
+    print("Corpus cache written to {}".format(cache_path))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,127 @@
+"""
+This module contains codec, which encodes tunes texts to symbol indices and
+decodes them back in bulk with numpy indexing, and its on-disk format.
+"""
+
+
+import pickle
+import struct
+
+import numpy as np
+
+
+__all__ = ["CODEC_VERSION", "CODEC_FILE", "Codec"]
+
+
+# Version of the codec file format, which is stored in its header.
+CODEC_VERSION = 1
+CODEC_MAGIC = b"BNCODEC\0"
+CODEC_FILE = "codec.bin"
+HEADER_FORMAT = "<II"
+
+
+class Codec:
+    """
+    This class describes codec of a vocabulary of symbols, where index of a
+    symbol is its position in the vocabulary. Symbols are encoded with lookup
+    table indexed by unicode codepoints and decoded by indexing array of
+    codepoints of the vocabulary, so whole lists of tunes are encoded into
+    ragged arrays of indices with offsets and decoded back at once.
+    """
+
+    def __init__(self, vocabulary):
+        self._codepoints = np.array([ord(symbol) for symbol in vocabulary],
+                                    dtype=np.uint32)
+        if len(np.unique(self._codepoints)) != len(self._codepoints):
+            raise ValueError("Vocabulary has repeated symbols.")
+        # The last entry of the table is always -1, so that codepoints beyond
+        # the table are clipped to it.
+        table_size = int(self._codepoints.max(initial=0)) + 2
+        self._table = np.full(table_size, -1, dtype=np.int64)
+        self._table[self._codepoints] = np.arange(len(self._codepoints))
+
+    @classmethod
+    def from_charset(cls, charset):
+        """ Create codec with sorted vocabulary of the charset symbols. """
+        return cls(sorted(charset))
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Load codec from the file saved with save. Encoder dictionaries
+        pickled by earlier versions are read as well.
+        """
+        with open(file_path, "rb") as file:
+            data = file.read()
+        if not data.startswith(CODEC_MAGIC):
+            encoder = pickle.loads(data)
+            return cls(sorted(encoder, key=encoder.get))
+        version, size = struct.unpack_from(HEADER_FORMAT, data,
+                                           len(CODEC_MAGIC))
+        if version > CODEC_VERSION:
+            raise ValueError("Codec file version {} isn't supported."
+                             .format(version))
+        codepoints = np.frombuffer(
+            data, dtype="<u4", count=size,
+            offset=len(CODEC_MAGIC) + struct.calcsize(HEADER_FORMAT)
+        )
+        return cls([chr(codepoint) for codepoint in codepoints])
+
+    def save(self, file_path):
+        """
+        Save codec as a header with format version and vocabulary size
+        followed by codepoints of the vocabulary.
+        """
+        with open(file_path, "wb") as file:
+            file.write(CODEC_MAGIC)
+            file.write(struct.pack(HEADER_FORMAT, CODEC_VERSION,
+                                   len(self._codepoints)))
+            file.write(self._codepoints.astype("<u4").tobytes())
+
+    def get_vocabulary(self):
+        """ Get list of vocabulary symbols in order of their indices. """
+        return [chr(codepoint) for codepoint in self._codepoints]
+
+    def encode(self, tune_text, unknown_index=None):
+        """ Encode tune text to array of symbol indices. """
+        return self.encode_many([tune_text], unknown_index)[0]
+
+    def decode(self, indices):
+        """ Decode array of symbol indices to text. """
+        return self._codepoints[indices].tobytes().decode("utf-32-le")
+
+    def encode_many(self, tunes_texts, unknown_index=None):
+        """
+        Encode list of tunes texts into flat array of symbol indices and array
+        of tunes offsets in it. Symbols outside of the vocabulary are encoded
+        as unknown_index, if it is given, or raise ValueError otherwise.
+        """
+        codepoints = np.frombuffer("".join(tunes_texts).encode("utf-32-le"),
+                                   dtype=np.uint32)
+        offsets = np.zeros(len(tunes_texts) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(tune_text) for tune_text in tunes_texts])
+        return self.encode_codepoints(codepoints, unknown_index), offsets
+
+    def decode_many(self, indices, offsets):
+        """
+        Decode flat array of symbol indices with tunes offsets to list of
+        texts.
+        """
+        text = self.decode(indices)
+        return [text[start:end] for start, end in zip(offsets[:-1],
+                                                       offsets[1:])]
+
+    def encode_codepoints(self, codepoints, unknown_index=None):
+        """ Encode array of unicode codepoints to array of symbol indices. """
+        indices = self._table[np.minimum(codepoints, len(self._table) - 1)]
+        is_unknown = indices < 0
+        if is_unknown.any():
+            if unknown_index is None:
+                raise ValueError("Symbols {} aren't in the vocabulary.".format(
+                    sorted(set(map(chr, codepoints[is_unknown])))
+                ))
+            indices[is_unknown] = unknown_index
+        return indices
+
+    def __len__(self):
+        return len(self._codepoints)
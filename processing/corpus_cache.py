@@ -0,0 +1,183 @@
+"""
+This module contains functions which encode filtered tunes into a flat corpus
+and cache it on disk, so that it can be memory mapped by later runs.
+"""
+
+
+import hashlib
+import os
+import shutil
+import tempfile
+from os import path
+
+import numpy as np
+
+from processing.codec import CODEC_FILE, Codec
+from processing.deduplication import Deduplicator, DeduplicatingSink
+from processing.ingestion import ingest_csv
+
+
+__all__ = ["CACHE_VERSION", "CorpusWriter", "encode_corpus", "get_cache_key",
+           "build_corpus_cache", "load_corpus_cache"]
+
+
+# Version of the cache layout, which is a part of the cache key.
+CACHE_VERSION = 3
+TOKENS_FILE = "tokens.bin"
+OFFSETS_FILE = "offsets.npy"
+TUNES_IDS_FILE = "tunes_ids.npy"
+CODEPOINTS_FILE = "codepoints.bin"
+# Number of codepoints encoded at once, when tokens file is written.
+ENCODING_CHUNK_SIZE = 1 << 24
+
+
+def encode_corpus(tunes):
+    """
+    Encode list of tune texts into one flat uint8 array of symbol indices and
+    array of tunes offsets in it. Return them with the codec, whose charset
+    always contains the newline character used as padding and is sorted, so
+    the encoding doesn't change between runs.
+    """
+    codec = _create_codec(np.unique(np.frombuffer(
+        "".join(tunes + ["\n"]).encode("utf-32-le"), dtype=np.uint32
+    )))
+    tokens, offsets = codec.encode_many(tunes)
+    return tokens.astype(np.uint8), offsets, codec
+
+
+class CorpusWriter:
+    """
+    This class describes sink of ingested tunes, which writes them to the
+    cache directory. Charset, and thus the codec, is known only after all
+    tunes are written, so their codepoints are spilled to a temporary file
+    and encoded into tokens on close. Encoding is the same as the one of
+    encode_corpus. Tune ids of the tunes are saved with their offsets.
+    """
+
+    def __init__(self, cache_path):
+        self._cache_path = cache_path
+        self._codepoints_file = open(path.join(cache_path, CODEPOINTS_FILE),
+                                     "wb")
+        self._charset_codepoints = np.array([ord("\n")], dtype=np.uint32)
+        self._lengths = []
+        self._tunes_ids = []
+
+    def write(self, codepoints, lengths, tunes_ids):
+        """
+        Append tunes given as flat codepoints, their lengths and tune ids.
+        """
+        codepoints.tofile(self._codepoints_file)
+        self._charset_codepoints = np.union1d(self._charset_codepoints,
+                                              np.unique(codepoints))
+        self._lengths.append(lengths)
+        self._tunes_ids.append(tunes_ids)
+
+    def close(self):
+        """ Write tokens, offsets and codec of all written tunes. """
+        self._codepoints_file.close()
+        codec = _create_codec(self._charset_codepoints)
+        codepoints_path = path.join(self._cache_path, CODEPOINTS_FILE)
+        with open(codepoints_path, "rb") as codepoints_file, \
+                open(path.join(self._cache_path, TOKENS_FILE), "wb") as file:
+            for chunk in iter(lambda: codepoints_file.read(
+                    4 * ENCODING_CHUNK_SIZE), b""):
+                codec.encode_codepoints(
+                    np.frombuffer(chunk, dtype=np.uint32)
+                ).astype(np.uint8).tofile(file)
+        os.remove(codepoints_path)
+        lengths = np.concatenate([np.zeros(1, dtype=np.int64)]
+                                 + self._lengths)
+        np.save(path.join(self._cache_path, OFFSETS_FILE), np.cumsum(lengths))
+        np.save(path.join(self._cache_path, TUNES_IDS_FILE),
+                np.concatenate([np.zeros(0, dtype=np.int64)]
+                               + self._tunes_ids))
+        codec.save(path.join(self._cache_path, CODEC_FILE))
+
+
+def get_cache_key(file_path, filtering_params, deduplication=None):
+    """
+    Create cache key from the contents of csv file, filtering parameters and
+    deduplication parameters.
+    """
+    key = hashlib.sha1()
+    with open(file_path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            key.update(chunk)
+    key.update(repr(sorted(filtering_params.items())).encode("utf-8"))
+    if deduplication is not None:
+        key.update(repr(sorted(deduplication.items())).encode("utf-8"))
+    key.update(str(CACHE_VERSION).encode("utf-8"))
+    return key.hexdigest()
+
+
+def build_corpus_cache(file_path, filtering_params, cache_root,
+                       processes_count=None, deduplication=None):
+    """
+    Read and encode tunes from the csv file in processes_count processes and
+    write them to the cache directory under cache_root. Return path of that
+    directory. If deduplication is given, duplicate tunes are dropped by
+    Deduplicator created with it as keyword arguments.
+    """
+    cache_path = path.join(cache_root, get_cache_key(
+        file_path, filtering_params, deduplication
+    ))
+    _write_corpus_cache(file_path, filtering_params, cache_path,
+                        processes_count, deduplication)
+    return cache_path
+
+
+def load_corpus_cache(file_path, filtering_params, cache_root,
+                      deduplication=None):
+    """
+    Load cached corpus for the csv file, filtering and deduplication
+    parameters, building it first if needed. Tokens are memory mapped. Return
+    tokens, offsets, codec and tune ids of tunes.
+    """
+    cache_path = path.join(cache_root, get_cache_key(
+        file_path, filtering_params, deduplication
+    ))
+    if not path.isdir(cache_path):
+        _write_corpus_cache(file_path, filtering_params, cache_path,
+                            deduplication=deduplication)
+    offsets = np.load(path.join(cache_path, OFFSETS_FILE))
+    tunes_ids = np.load(path.join(cache_path, TUNES_IDS_FILE))
+    if offsets[-1] > 0:
+        tokens = np.memmap(path.join(cache_path, TOKENS_FILE), dtype=np.uint8,
+                           mode="r")
+    else:
+        # Empty files can't be memory mapped.
+        tokens = np.zeros(0, dtype=np.uint8)
+    codec = Codec.load(path.join(cache_path, CODEC_FILE))
+    return tokens, offsets, codec, tunes_ids
+
+
+def _write_corpus_cache(file_path, filtering_params, cache_path,
+                        processes_count=None, deduplication=None):
+    """ Stream ingested tunes to the given cache directory. """
+    cache_root = path.dirname(cache_path)
+    os.makedirs(cache_root, exist_ok=True)
+    # Files are written to a temporary directory first, so that concurrent
+    # runs never see a partially written cache.
+    temp_path = tempfile.mkdtemp(dir=cache_root)
+    try:
+        writer = CorpusWriter(temp_path)
+        if deduplication is not None:
+            writer = DeduplicatingSink(writer, Deduplicator(**deduplication))
+        ingest_csv(file_path, filtering_params, writer, processes_count)
+        writer.close()
+    except BaseException:
+        shutil.rmtree(temp_path)
+        raise
+    try:
+        os.rename(temp_path, cache_path)
+    except OSError:
+        # Other run has already written the same cache.
+        shutil.rmtree(temp_path)
+
+
+def _create_codec(charset_codepoints):
+    """ Create codec of sorted charset codepoints, which fits uint8 tokens. """
+    if len(charset_codepoints) > np.iinfo(np.uint8).max + 1:
+        raise ValueError("Charset of {} symbols doesn't fit into uint8 tokens."
+                         .format(len(charset_codepoints)))
+    return Codec([chr(codepoint) for codepoint in charset_codepoints])
@@ -4,142 +4,412 @@ models.
 """
 
 
-import pickle
 from os import path
-from random import shuffle
 
 import numpy as np
 
+from processing.codec import CODEC_FILE
+from processing.corpus_cache import encode_corpus, load_corpus_cache
 from processing.data_utils import *
+from processing.deduplication import Deduplicator
 
 
 class Dataset:
-    """ This class defines dataset which provides training examples  """
+    """
+    This class defines dataset which provides training examples. By default
+    every batch row holds a single tune padded to a multiple of roll_out and
+    its state is reset, when the tune is replaced. With packing, tunes are
+    concatenated with separators into one continuous stream per batch row, so
+    batches hold no padding and states are reset only with a new pass over
+    the set. Tunes are shuffled with shuffle_seed, if it is given, and whole
+    batching state can be saved and restored with get_state and set_state.
+    If deduplication is given, duplicate tunes are dropped by Deduplicator
+    created with it as keyword arguments. With group_by_tune, all settings of
+    a tune fall into the same subset.
+    """
 
     SUBSETS_COUNT = 3
     # Constant indices of subsets of tunes in _tunes list.
     TRAIN, VAL, TEST = range(SUBSETS_COUNT)
+    # Character used to pad tunes.
+    PADDING_CHAR = "\n"
 
     def __init__(self, file_path, filtering_params, batch_size, roll_out,
-                 subsets_sizes):
+                 subsets_sizes, cache_root=None, split_seed=None,
+                 packing=False, shuffle_seed=None, deduplication=None,
+                 group_by_tune=False):
         self._batch_size = batch_size
         self._roll_out = roll_out
-        self._init_sets(file_path, filtering_params, subsets_sizes, roll_out)
-        self._init_encoding()
+        self._packing = packing
+        self._random = np.random.RandomState(shuffle_seed)
+        self._init_corpus(file_path, filtering_params, cache_root,
+                          deduplication)
+        self._init_sets(subsets_sizes, roll_out, split_seed, group_by_tune)
         self._init_queues()
         self._init_batching()
+        self._restored_batches = {}
 
     def get_next_batch(self, set_index, lstm_state):
-        """ Get next batch of tunes text from selected set. """
+        """ Get next batch of tunes symbol indices from selected set. """
+        batch, reset_rows, queue_reset_occurred = (
+            self.get_next_batch_with_resets(set_index)
+        )
+        # State is in shape of [layers, 2, batch, num_neurons] and we reset
+        # every element of state for rows with replaced tunes.
+        lstm_state[:, :, reset_rows] = 0
+        return batch, queue_reset_occurred
+
+    def get_next_batch_with_resets(self, set_index):
+        """
+        Get next batch of tunes symbol indices from selected set together with
+        mask of batch rows, which lstm state has to be reset for, because their
+        tunes were replaced. Returned batch matrix is reused between calls for
+        the same set. Batches prefetched in the restored state are served
+        first.
+        """
+        if self._restored_batches.get(set_index):
+            batch, reset_rows, queue_reset_occurred = (
+                self._restored_batches[set_index].pop(0)
+            )
+            np.copyto(self._batch_matrices[set_index], batch)
+            return (self._batch_matrices[set_index], reset_rows.copy(),
+                    queue_reset_occurred)
+        if self._packing:
+            return self._get_next_packed_batch(set_index)
         queue_reset_occurred = False
-        while self._check_current_tunes(set_index, lstm_state):
+        reset_rows = np.zeros(self._batch_size, dtype=bool)
+        exhausted_rows = self._check_current_tunes(set_index)
+        while exhausted_rows.any():
+            reset_rows |= exhausted_rows
             fill_reset = self._fill_empty_indices(set_index)
             queue_reset_occurred = queue_reset_occurred or fill_reset
+            exhausted_rows = self._check_current_tunes(set_index)
         self._fill_batch_matrix(set_index)
         self._advance_batch(set_index)
-        return self._batch_matrix, queue_reset_occurred
+        return (self._batch_matrices[set_index], reset_rows,
+                queue_reset_occurred)
+
+    def shard_train_set(self, shard_index, shards_count):
+        """
+        Keep only every shards_count-th tune of the train set starting from
+        shard_index, so that data parallel workers train on disjoint shards.
+        Workers have to use the same split_seed to share subsets.
+        """
+        train_tunes = self._tunes[self.TRAIN][shard_index::shards_count]
+        if len(train_tunes) == 0:
+            raise ValueError("Train set is too small for {} shards."
+                             .format(shards_count))
+        self._tunes[self.TRAIN] = train_tunes
+        self._tunes_lengths[self.TRAIN] = (
+            self._tunes_lengths[self.TRAIN][shard_index::shards_count]
+        )
+        self._reset_queue(self.TRAIN)
+        self._restart_batching(self.TRAIN)
+
+    def create_sample(self, set_index, batches_count, seed=0):
+        """
+        Create BatchSample of the first batches_count batches of selected set
+        in order given by seed, so that the same sample is drawn every time.
+        Sample is shorter, if the set ends earlier. Set is batched from the
+        start afterwards.
+        """
+        self._queues[set_index] = np.random.RandomState(seed).permutation(
+            len(self._tunes[set_index])
+        )
+        self._restart_batching(set_index)
+        batches = []
+        for _ in range(batches_count):
+            batch, reset_rows, queue_reset_occurred = (
+                self.get_next_batch_with_resets(set_index)
+            )
+            if queue_reset_occurred:
+                break
+            batches.append((batch.copy(), reset_rows))
+        self._reset_queue(set_index)
+        self._restart_batching(set_index)
+        return BatchSample(batches)
+
+    def get_padding_efficiency(self, set_index):
+        """
+        Get fraction of symbols in batches of selected set served so far,
+        which are tunes text rather than padding or separators.
+        """
+        if self._served_counts[set_index] == 0:
+            return 1.0
+        return self._text_counts[set_index] / self._served_counts[set_index]
+
+    def get_state(self):
+        """
+        Get copy of batching state of all subsets, that is their tunes,
+        queues, current tunes, positions in them or in packed rows, served
+        symbols counts and restored batches, which aren't served yet, together
+        with state of the shuffling random generator.
+        """
+        return {"tunes": [subset.copy() for subset in self._tunes],
+                "queues": [queue.copy() for queue in self._queues],
+                "tunes_indices": [indices.copy()
+                                  for indices in self._tunes_indices],
+                "tunes_positions": [positions.copy()
+                                    for positions in self._tunes_positions],
+                "packed_positions": self._packed_positions.copy(),
+                "served_counts": self._served_counts.copy(),
+                "text_counts": self._text_counts.copy(),
+                "random_state": self._random.get_state(),
+                "prefetched_batches": {
+                    set_index: list(batches) for set_index, batches
+                    in self._restored_batches.items() if batches
+                }}
+
+    def set_state(self, state):
+        """
+        Restore batching state returned by get_state of a dataset created
+        with the same parameters. Packed rows are packed again from the
+        restored queues. Batches prefetched by BatchPrefetcher, when the state
+        was taken, are served before new ones. Raise ValueError, if the state
+        belongs to a different split of tunes or batch size.
+        """
+        for i in range(self.SUBSETS_COUNT):
+            if not np.array_equal(state["tunes"][i], self._tunes[i]):
+                raise ValueError("Subset {} of the state differs from the one "
+                                 "of the dataset, which has to be created "
+                                 "with the same split_seed.".format(i))
+            if (len(state["tunes_indices"][i]) != self._batch_size
+                    or len(state["queues"][i]) > len(self._tunes[i])):
+                raise ValueError("Batching state of subset {} doesn't match "
+                                 "batch size and size of the subset."
+                                 .format(i))
+        prefetched_batches = state.get("prefetched_batches", {})
+        for set_index, batches in prefetched_batches.items():
+            for batch, _, _ in batches:
+                if batch.shape != self._batch_matrices[set_index].shape:
+                    raise ValueError("Prefetched batches of subset {} don't "
+                                     "match batch size and roll out."
+                                     .format(set_index))
+        self._restored_batches = {
+            set_index: list(batches)
+            for set_index, batches in prefetched_batches.items()
+        }
+        self._random.set_state(state["random_state"])
+        for i in range(self.SUBSETS_COUNT):
+            self._queues[i] = state["queues"][i].copy()
+            np.copyto(self._tunes_indices[i], state["tunes_indices"][i])
+            np.copyto(self._tunes_positions[i], state["tunes_positions"][i])
+            if self._packing:
+                self._pack_rows(i)
+        np.copyto(self._packed_positions, state["packed_positions"])
+        np.copyto(self._served_counts, state["served_counts"])
+        np.copyto(self._text_counts, state["text_counts"])
 
     def get_charset_size(self):
         """ Access point for the charset size of the dataset. """
         return self._charset_size
 
     def save_encoding(self, dir_path):
-        """ Save encoder and decoder in target directory. """
-        with open(path.join(dir_path, "encoder.dict"), "wb") as file:
-            pickle.dump(self._encoder, file)
-        with open(path.join(dir_path, "decoder.dict"), "wb") as file:
-            pickle.dump(self._decoder, file)
+        """ Save codec of the dataset in target directory. """
+        self._codec.save(path.join(dir_path, CODEC_FILE))
 
     def _fill_batch_matrix(self, set_index):
         """ Fill in the batch matrix. """
-        for i in range(self._batch_size):
-            tune_index = self._tunes_indices[set_index][i]
-            tune_position = self._tunes_positions[set_index][i]
-            tune_fragment = (self._tunes[set_index][tune_index]
-                             [tune_position:tune_position + self._roll_out])
-            self._batch_matrix[:, i, :] = encode_tune_text(tune_fragment,
-                                                           self._encoder)
+        tunes = self._tunes[set_index][self._tunes_indices[set_index]]
+        fragments_starts = (self._offsets[tunes]
+                            + self._tunes_positions[set_index])
+        tunes_ends = self._offsets[tunes + 1]
+        # Matrix of corpus positions in shape of [roll_out, batch].
+        tokens_positions = (fragments_starts[np.newaxis]
+                            + np.arange(self._roll_out)[:, np.newaxis])
+        # Tunes are padded on the fly, corpus holds only their text.
+        is_text = tokens_positions < tunes_ends
+        self._count_served_symbols(set_index, is_text)
+        batch_matrix = self._batch_matrices[set_index]
+        np.copyto(batch_matrix, self._padding_index)
+        np.copyto(batch_matrix,
+                  self._tokens.take(tokens_positions, mode="clip"),
+                  where=is_text)
+
+    def _restart_batching(self, set_index):
+        """ Start batching selected set from the start of its queue. """
+        if self._packing:
+            self._pack_rows(set_index)
+            return
+        self._tunes_indices[set_index][:] = -1
+        self._tunes_positions[set_index][:] = 0
+        self._fill_empty_indices(set_index)
+
+    def _get_next_packed_batch(self, set_index):
+        """
+        Get next window of packed rows of selected set. Rows are packed again
+        from a new queue once they are exhausted, which resets all states.
+        """
+        queue_reset_occurred = False
+        position = self._packed_positions[set_index]
+        if position + self._roll_out > self._packed_rows_lengths[set_index]:
+            queue_reset_occurred = True
+            self._reset_queue(set_index)
+            self._pack_rows(set_index)
+            position = 0
+        # Matrix in shape of [roll_out, batch] of positions in the stream of
+        # separated tunes, which rows are consecutive parts of.
+        rows_starts = (np.arange(self._batch_size)
+                       * self._packed_rows_lengths[set_index])
+        stream_positions = (position + np.arange(self._roll_out)[:, np.newaxis]
+                            + rows_starts)
+        bounds = self._packed_bounds[set_index]
+        tunes = np.searchsorted(bounds, stream_positions, side="right") - 1
+        # Last symbol of every tune in the stream is its separator.
+        is_text = stream_positions < bounds[tunes + 1] - 1
+        self._count_served_symbols(set_index, is_text)
+        symbols = self._tokens.take(
+            self._packed_starts[set_index][tunes] + stream_positions
+            - bounds[tunes], mode="clip"
+        )
+        batch_matrix = self._batch_matrices[set_index]
+        np.copyto(batch_matrix, np.where(is_text, symbols,
+                                         self._padding_index))
+        self._packed_positions[set_index] += self._roll_out
+        reset_rows = np.full(self._batch_size, queue_reset_occurred)
+        return batch_matrix, reset_rows, queue_reset_occurred
+
+    def _pack_rows(self, set_index):
+        """
+        Pack tunes of selected set in order of its queue, each followed by a
+        separator, into one stream split evenly between batch rows. Only
+        bounds of tunes in the stream and their corpus offsets are kept, and
+        windows of rows are read from the corpus as they are served.
+        """
+        tunes = self._tunes[set_index][self._queues[set_index]]
+        starts = self._offsets[tunes]
+        bounds = np.zeros(len(tunes) + 1, dtype=np.int64)
+        np.cumsum(self._offsets[tunes + 1] - starts + 1, out=bounds[1:])
+        row_length = bounds[-1] // self._batch_size
+        if row_length < self._roll_out:
+            raise ValueError("Subset {} is too small to be packed into {} "
+                             "rows.".format(set_index, self._batch_size))
+        self._packed_starts[set_index] = starts
+        self._packed_bounds[set_index] = bounds
+        self._packed_rows_lengths[set_index] = row_length
+        self._packed_positions[set_index] = 0
+
+    def _count_served_symbols(self, set_index, is_text):
+        """ Count symbols and text symbols of batch served from the set. """
+        self._served_counts[set_index] += is_text.size
+        self._text_counts[set_index] += np.count_nonzero(is_text)
 
     def _advance_batch(self, set_index):
         """ Advance tunes position by the length of LSTM roll out. """
-        for i in range(self._batch_size):
-            self._tunes_positions[set_index][i] += self._roll_out
+        self._tunes_positions[set_index] += self._roll_out
 
     def _reset_queue(self, set_index):
         """
         Reset queue of elements which will be provided consecutively to the
         model.
         """
-        # We use list for efficient dynamic sizing.
-        self._queues[set_index] = list(
-            np.random.permutation(len(self._tunes[set_index]))
+        self._queues[set_index] = self._random.permutation(
+            len(self._tunes[set_index])
         )
 
-    def _check_current_tunes(self, set_index, lstm_state):
+    def _check_current_tunes(self, set_index):
         """
         Check, if tunes currently used in the batch have enough characters left
         for another training iteration with given roll_out. Discard indices
-        of tunes which don't satisfy this requirement and reset state for those
-        tunes.
+        of tunes which don't satisfy this requirement and return mask of their
+        rows.
         """
-        reset_occurred = False
-        for i in range(self._batch_size):
-            tune_len = len(
-                self._tunes[set_index][self._tunes_indices[set_index][i]]
-            )
-            current_tune_position = self._tunes_positions[set_index][i]
-            if current_tune_position + self._roll_out > tune_len:
-                reset_occurred = True
-                self._tunes_indices[set_index][i] = None
-                self._tunes_positions[set_index][i] = 0
-                # State is in shape of [layers, 2, batch, num_neurons] and we
-                # reset every element of state for selected batch index.
-                for layer_state in lstm_state:
-                    layer_state[:, i] = 0
-        return reset_occurred
+        tunes_indices = self._tunes_indices[set_index]
+        tunes_positions = self._tunes_positions[set_index]
+        tunes_lengths = self._tunes_lengths[set_index][tunes_indices]
+        exhausted_rows = ((tunes_indices < 0)
+                          | (tunes_positions + self._roll_out > tunes_lengths))
+        tunes_indices[exhausted_rows] = -1
+        tunes_positions[exhausted_rows] = 0
+        return exhausted_rows
 
     def _fill_empty_indices(self, set_index):
         """
         Fill in empty tune indices for given set with the next indices taken
-        from tunes queue. Reset queue, if there are no tunes left in it.
+        from the end of tunes queue. Reset queue, if there are no tunes left in
+        it.
         """
         queue_reset_occurred = False
-        for i in range(self._batch_size):
-            if self._tunes_indices[set_index][i] is None:
-                if len(self._queues[set_index]) == 0:
-                    queue_reset_occurred = True
-                    self._reset_queue(set_index)
-                self._tunes_indices[set_index][i] = (self._queues[set_index]
-                                                     .pop())
+        empty_rows = np.flatnonzero(self._tunes_indices[set_index] < 0)
+        while len(empty_rows) > 0:
+            if len(self._queues[set_index]) == 0:
+                queue_reset_occurred = True
+                self._reset_queue(set_index)
+            queue = self._queues[set_index]
+            taken_count = min(len(empty_rows), len(queue))
+            self._tunes_indices[set_index][empty_rows[:taken_count]] = (
+                queue[len(queue) - taken_count:]
+            )
+            self._queues[set_index] = queue[:len(queue) - taken_count]
+            empty_rows = empty_rows[taken_count:]
         return queue_reset_occurred
 
     # Initialization routines.
 
-    def _init_sets(self, file_path, filtering_params, subsets_sizes, roll_out):
-        """ Initialize train, validation and tests subsets. """
+    def _init_corpus(self, file_path, filtering_params, cache_root,
+                     deduplication):
+        """
+        Initialize flat corpus of encoded tunes with their offsets, tune ids
+        and the codec. Corpus is memory mapped from cache_root, if it is
+        given.
+        """
+        if cache_root is None:
+            rows = read_csv(file_path, [TUNE, ABC], filtering_params)
+            if deduplication is not None:
+                is_kept = Deduplicator(**deduplication).filter(
+                    [row[1] for row in rows]
+                )
+                rows = [row for row, is_row_kept in zip(rows, is_kept)
+                        if is_row_kept]
+            tunes_ids = np.array([int(row[0]) for row in rows],
+                                 dtype=np.int64)
+            corpus = encode_corpus([row[1] for row in rows]) + (tunes_ids,)
+        else:
+            corpus = load_corpus_cache(file_path, filtering_params,
+                                       cache_root, deduplication)
+        self._tokens, self._offsets, self._codec, self._tunes_ids = corpus
+        self._charset_size = len(self._codec)
+        self._padding_index = self._codec.encode(self.PADDING_CHAR)[0]
+
+    def _init_sets(self, subsets_sizes, roll_out, split_seed, group_by_tune):
+        """
+        Initialize train, validation and tests subsets, which hold tunes
+        indices in the corpus, and lengths of padded tunes. Split is
+        reproducible, if split_seed is given. With group_by_tune, tunes are
+        ordered by randomly ordered tune ids and splits are moved to the
+        starts of tune ids groups.
+        """
         train_size, val_size, _ = subsets_sizes
-        tunes = read_csv(file_path, [ABC], filtering_params)
-        # Extract only text from list of elements.
-        for i in range(len(tunes)):
-            tunes[i] = tunes[i][0]
-            # Pad tunes at the end with newline characters.
-            tunes[i] += "\n" * (roll_out - (len(tunes) % roll_out))
-        shuffle(tunes)
+        tunes_count = len(self._offsets) - 1
+        random = np.random.RandomState(split_seed)
+        if group_by_tune:
+            _, groups = np.unique(self._tunes_ids, return_inverse=True)
+            groups_ranks = random.permutation(len(self._tunes_ids))[groups]
+            tunes = np.argsort(groups_ranks, kind="stable")
+            tunes_ranks = groups_ranks[tunes]
+        else:
+            tunes = random.permutation(tunes_count)
+        # Tunes are padded at the end with at least one newline character up
+        # to a multiple of roll_out, so that no text is discarded.
+        lengths = np.diff(self._offsets)
+        padded_lengths = lengths + roll_out - lengths % roll_out
         # Split tunes between train, validation and test subsets.
-        first_split = int(train_size * len(tunes))
-        second_split = int((val_size + train_size) * len(tunes))
-        self._tunes = [None] * self.SUBSETS_COUNT
-        self._tunes[self.TRAIN] = tunes[:first_split]
-        self._tunes[self.VAL] = tunes[first_split:second_split]
-        self._tunes[self.TEST] = tunes[second_split:]
-
-    def _init_encoding(self):
-        """ Initialize encoder and decoder used by dataset. """
-        charset = find_charset(self._tunes[self.TRAIN])
-        charset = charset.union(find_charset(self._tunes[self.VAL]))
-        charset = charset.union(find_charset(self._tunes[self.TEST]))
-        self._charset_size = len(charset)
-        self._encoder, self._decoder = create_encoding(charset)
+        splits = [int(train_size * tunes_count),
+                  int((val_size + train_size) * tunes_count)]
+        if group_by_tune:
+            splits = [np.searchsorted(tunes_ranks, tunes_ranks[split])
+                      if split < tunes_count else split
+                      for split in splits]
+        self._tunes = np.split(tunes, splits)
+        # Batching of an empty subset would never fill its rows.
+        for set_index, subset in enumerate(self._tunes):
+            if len(subset) == 0:
+                raise ValueError("Subset {} is empty after splitting {} tunes "
+                                 "with sizes {}.".format(set_index,
+                                                         tunes_count,
+                                                         subsets_sizes))
+        self._tunes_lengths = [padded_lengths[subset]
+                               for subset in self._tunes]
 
     def _init_queues(self):
         """
@@ -153,15 +423,61 @@ class Dataset:
     def _init_batching(self):
         """
         Create structures needed to batch train, validation and test sets. Those
-        structures are list of indices of currently used tunes and list of
-        text positions in those tunes.
+        structures are arrays of indices of currently used tunes, where -1
+        marks an empty row, and arrays of text positions in those tunes. Every
+        subset has its own batch matrix, so subsets can be batched
+        concurrently. With packing, every subset has bounds of its packed
+        tunes, length of packed rows and position of the next window in them
+        instead.
         """
+        self._served_counts = np.zeros(self.SUBSETS_COUNT, dtype=np.int64)
+        self._text_counts = np.zeros(self.SUBSETS_COUNT, dtype=np.int64)
+        self._packed_starts = [None] * self.SUBSETS_COUNT
+        self._packed_bounds = [None] * self.SUBSETS_COUNT
+        self._packed_rows_lengths = np.zeros(self.SUBSETS_COUNT,
+                                             dtype=np.int64)
+        self._packed_positions = np.zeros(self.SUBSETS_COUNT, dtype=np.int64)
         self._tunes_indices = [None] * self.SUBSETS_COUNT
         self._tunes_positions = [None] * self.SUBSETS_COUNT
+        self._batch_matrices = [None] * self.SUBSETS_COUNT
         for i in range(self.SUBSETS_COUNT):
-            self._tunes_indices[i] = [None] * self._batch_size
-            self._tunes_positions[i] = [0] * self._batch_size
-            self._fill_empty_indices(i)
-        self._batch_matrix = np.zeros(
-            [self._roll_out, self._batch_size, self._charset_size]
-        )
+            self._tunes_indices[i] = np.full(self._batch_size, -1,
+                                             dtype=np.int64)
+            self._tunes_positions[i] = np.zeros(self._batch_size,
+                                                dtype=np.int64)
+            self._batch_matrices[i] = np.zeros(
+                [self._roll_out, self._batch_size], dtype=np.int32
+            )
+            if self._packing:
+                self._pack_rows(i)
+            else:
+                self._fill_empty_indices(i)
+
+
+class BatchSample:
+    """
+    This class defines fixed sequence of batches, which is served in the same
+    way as Dataset subsets. Queue reset is reported with the last batch, so
+    runs over the sample stop there, and the sample starts over afterwards.
+    """
+
+    def __init__(self, batches):
+        if len(batches) == 0:
+            raise ValueError("Sample needs at least one batch.")
+        self._batches = batches
+        self._position = 0
+
+    def get_next_batch_with_resets(self, set_index):
+        """
+        Get next batch of the sample, mask of rows, which lstm state has to be
+        reset for, and queue reset flag. All rows are reset with the first
+        batch. Set index is ignored.
+        """
+        batch, reset_rows = self._batches[self._position]
+        if self._position == 0:
+            reset_rows = np.ones_like(reset_rows)
+        self._position = (self._position + 1) % len(self._batches)
+        return batch, reset_rows, self._position == 0
+
+    def __len__(self):
+        return len(self._batches)
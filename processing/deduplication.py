@@ -0,0 +1,140 @@
+"""
+This module contains elimination of duplicate and near duplicate tunes, which
+compares normalized abc bodies by exact hashes and by MinHash signatures
+bucketed with locality sensitive hashing.
+"""
+
+
+import hashlib
+import re
+
+import numpy as np
+
+
+__all__ = ["normalize_abc", "Deduplicator", "DeduplicatingSink"]
+
+
+COMMENT_PATTERN = re.compile(r"%[^\n]*")
+WHITESPACE_PATTERN = re.compile(r"\s+")
+SHINGLE_BASE = 1000003
+
+
+def normalize_abc(tune_text):
+    """
+    Normalize abc body, so that tunes differing only in comments and
+    whitespace are equal.
+    """
+    return WHITESPACE_PATTERN.sub("", COMMENT_PATTERN.sub("", tune_text))
+
+
+class Deduplicator:
+    """
+    This class describes filter of duplicate tunes, which keeps the first of
+    equal or similar tunes it is shown. Tunes are duplicates, if their
+    normalized bodies are equal, or, unless near_threshold is None, if
+    Jaccard similarity of their sets of shingle_size symbols long shingles,
+    estimated with MinHash signatures, is at least near_threshold. Only tunes,
+    which share a band of band_size signature values with each other, are
+    compared, so time is near linear in the number of tunes.
+    """
+
+    # Number of kept tunes per band bucket, which new tunes are compared to.
+    MAX_BUCKET_SIZE = 8
+
+    def __init__(self, near_threshold=0.8, shingle_size=5, bands_count=16,
+                 band_size=8, seed=0):
+        self._near_threshold = near_threshold
+        self._shingle_size = shingle_size
+        self._bands_count = bands_count
+        self._band_size = band_size
+        random = np.random.RandomState(seed)
+        hashes_count = bands_count * band_size
+        # Odd multipliers make multiply-add hashes permutations of uint64.
+        self._multipliers = random.randint(
+            0, np.iinfo(np.int64).max, hashes_count, dtype=np.int64
+        ).astype(np.uint64) | np.uint64(1)
+        self._increments = random.randint(
+            0, np.iinfo(np.int64).max, hashes_count, dtype=np.int64
+        ).astype(np.uint64)
+        self._digests = set()
+        self._buckets = {}
+        self._signatures = []
+
+    def is_duplicate(self, tune_text):
+        """
+        Check, if the tune is a duplicate of any of the tunes kept so far, and
+        keep it, if it isn't.
+        """
+        normalized_text = normalize_abc(tune_text)
+        digest = hashlib.blake2b(normalized_text.encode("utf-8"),
+                                 digest_size=16).digest()
+        if digest in self._digests:
+            return True
+        if self._near_threshold is not None:
+            signature = self._create_signature(normalized_text)
+            bands_keys = [
+                (band, signature[band * self._band_size:
+                                 (band + 1) * self._band_size].tobytes())
+                for band in range(self._bands_count)
+            ]
+            candidates = set()
+            for band_key in bands_keys:
+                candidates.update(self._buckets.get(band_key, []))
+            for candidate in candidates:
+                similarity = np.mean(signature == self._signatures[candidate])
+                if similarity >= self._near_threshold:
+                    return True
+            for band_key in bands_keys:
+                bucket = self._buckets.setdefault(band_key, [])
+                if len(bucket) < self.MAX_BUCKET_SIZE:
+                    bucket.append(len(self._signatures))
+            self._signatures.append(signature)
+        self._digests.add(digest)
+        return False
+
+    def filter(self, tunes_texts):
+        """ Return mask of tunes, which aren't duplicates and are kept. """
+        return np.array([not self.is_duplicate(tune_text)
+                         for tune_text in tunes_texts], dtype=bool)
+
+    def _create_signature(self, normalized_text):
+        """ Create MinHash signature of shingles of the normalized text. """
+        codepoints = np.frombuffer(normalized_text.encode("utf-32-le"),
+                                   dtype=np.uint32).astype(np.uint64)
+        shingles_count = max(1, len(codepoints) - self._shingle_size + 1)
+        shingles = np.zeros(shingles_count, dtype=np.uint64)
+        for i in range(min(self._shingle_size, len(codepoints))):
+            shingles = (shingles * np.uint64(SHINGLE_BASE)
+                        + codepoints[i:i + shingles_count])
+        shingles = np.unique(shingles)
+        # Low bits are mixed into high ones, which decide the minimum.
+        shingles ^= shingles >> np.uint64(29)
+        return (shingles[:, np.newaxis] * self._multipliers
+                + self._increments).min(axis=0)
+
+
+class DeduplicatingSink:
+    """
+    This class describes sink of ingested tunes, which passes only tunes, that
+    aren't duplicates according to the deduplicator, to the wrapped sink.
+    """
+
+    def __init__(self, sink, deduplicator):
+        self._sink = sink
+        self._deduplicator = deduplicator
+
+    def write(self, codepoints, lengths, tunes_ids):
+        """ Write tunes, which aren't duplicates, to the wrapped sink. """
+        offsets = np.concatenate([[0], np.cumsum(lengths)])
+        tunes_texts = [
+            codepoints[start:end].tobytes().decode("utf-32-le")
+            for start, end in zip(offsets[:-1], offsets[1:])
+        ]
+        is_kept = self._deduplicator.filter(tunes_texts)
+        kept_codepoints = np.repeat(is_kept, lengths)
+        self._sink.write(codepoints[kept_codepoints], lengths[is_kept],
+                         tunes_ids[is_kept])
+
+    def close(self):
+        """ Close the wrapped sink. """
+        self._sink.close()
@@ -0,0 +1,138 @@
+"""
+This module contains streaming ingestion of the tunes .csv file, which parses
+and filters byte ranges of the file in a pool of processes and passes encoded
+tunes of every range with their tune ids to a sink in the file order.
+"""
+
+
+import csv
+import io
+import multiprocessing
+import os
+import re
+from collections import deque
+
+import numpy as np
+
+from processing.data_utils import *
+
+
+__all__ = ["RANGE_SIZE", "find_byte_ranges", "read_range", "ingest_csv"]
+
+
+# Approximate size of byte ranges parsed by a single process.
+RANGE_SIZE = 1 << 24
+# Rows start with numeric tune and setting ids, optionally quoted.
+ROW_START_PATTERN = re.compile(rb'\n"?\d+"?,"?\d+"?,')
+SEARCH_BLOCK_SIZE = 1 << 16
+# Number of bytes read to validate, that a row starts at the found offset.
+VALIDATION_BLOCK_SIZE = 1 << 20
+
+
+def find_byte_ranges(file_path, range_size=RANGE_SIZE):
+    """
+    Split the .csv file after its header row into list of (start, end) byte
+    ranges of about range_size bytes, which start at rows starts. Rows can
+    span several lines, so line starts are accepted as rows starts only if
+    they begin with tune and setting ids and parse to a full row.
+    """
+    file_size = os.path.getsize(file_path)
+    with open(file_path, "rb") as file:
+        file.readline()
+        starts = [file.tell()]
+        while starts[-1] + range_size < file_size:
+            # Search starts one byte earlier, so that row starting exactly
+            # at the range boundary is found.
+            start = _find_row_start(file, starts[-1] + range_size - 1)
+            if start is None:
+                break
+            starts.append(start)
+    starts.append(file_size)
+    return list(zip(starts[:-1], starts[1:]))
+
+
+def read_range(file_path, start, end, filters):
+    """
+    Read rows from the byte range of the .csv file, which match filters from
+    create_filters, and encode their abc texts into flat array of unicode
+    codepoints. Return the codepoints, array of texts lengths and array of
+    tune ids of the rows.
+    """
+    with open(file_path, "rb") as file:
+        file.seek(start)
+        text = file.read(end - start).decode("utf-8")
+    # Newlines are translated the same way read_csv's text file does.
+    csv_reader = csv.reader(io.StringIO(text, newline=None), escapechar="\\",
+                            doublequote=False)
+    rows = [row for row in csv_reader if is_matching(row, filters)]
+    codepoints = np.frombuffer(
+        "".join(row[ABC] for row in rows).encode("utf-32-le"), dtype=np.uint32
+    )
+    lengths = np.array([len(row[ABC]) for row in rows], dtype=np.int64)
+    tunes_ids = np.array([int(row[TUNE]) for row in rows], dtype=np.int64)
+    return codepoints, lengths, tunes_ids
+
+
+def ingest_csv(file_path, filtering_params, sink, processes_count=None,
+               range_size=RANGE_SIZE):
+    """
+    Read and filter tunes from the .csv file in processes_count processes,
+    all available cpus by default, and pass encoded tunes of every byte range
+    with their tune ids to sink.write in the file order. At most two ranges
+    per process are kept waiting for the sink, so memory usage doesn't
+    depend on the file size.
+    """
+    processes_count = processes_count or os.cpu_count()
+    filters = create_filters(filtering_params)
+    tasks = [(file_path, start, end, filters)
+             for start, end in find_byte_ranges(file_path, range_size)]
+    if processes_count == 1 or len(tasks) <= 1:
+        for task in tasks:
+            sink.write(*read_range(*task))
+        return
+    # Processes are spawned, so that ingestion can be run from processes,
+    # which have already started tensorflow.
+    context = multiprocessing.get_context("spawn")
+    with context.Pool(min(processes_count, len(tasks))) as pool:
+        pending_results = deque()
+        for task in tasks:
+            pending_results.append(pool.apply_async(read_range, task))
+            if len(pending_results) > 2 * processes_count:
+                sink.write(*pending_results.popleft().get())
+        while pending_results:
+            sink.write(*pending_results.popleft().get())
+
+
+def _find_row_start(file, offset):
+    """
+    Find offset of the first row start after the given offset, or None, if
+    there isn't any.
+    """
+    file.seek(offset)
+    buffer = b""
+    buffer_offset = offset
+    while True:
+        block = file.read(SEARCH_BLOCK_SIZE)
+        if not block:
+            return None
+        buffer += block
+        for match in ROW_START_PATTERN.finditer(buffer):
+            row_start = buffer_offset + match.start() + 1
+            if _is_row_start(file, row_start):
+                return row_start
+        # Tail of the buffer is kept, as it can hold a part of a match.
+        kept_size = min(len(buffer), 64)
+        buffer_offset += len(buffer) - kept_size
+        buffer = buffer[len(buffer) - kept_size:]
+        file.seek(buffer_offset + kept_size)
+
+
+def _is_row_start(file, offset):
+    """ Check, if a full row can be parsed from the offset. """
+    file.seek(offset)
+    text = file.read(VALIDATION_BLOCK_SIZE).decode("utf-8", errors="replace")
+    csv_reader = csv.reader(io.StringIO(text, newline=None), escapechar="\\",
+                            doublequote=False)
+    row = next(csv_reader, [])
+    return (len(row) == COLUMNS_COUNT and row[TUNE].isdigit()
+            and row[SETTING].isdigit())
@@ -0,0 +1,123 @@
+"""
+This module contains definition of a class which prepares dataset batches in
+background threads.
+"""
+
+
+import queue
+import threading
+
+
+class BatchPrefetcher:
+    """
+    This class defines producer, which keeps bounded queues of ready batches
+    for every dataset subset. It provides the same get_next_batch_with_resets
+    method as Dataset, so lstm state resets are handed over to the consumer
+    together with the batches. Dataset is used by one producer at a time, so
+    that its state always matches the batches waiting in queues.
+    """
+
+    # Interval in seconds, in which producers check if they should stop.
+    STOP_CHECK_INTERVAL = 0.1
+
+    def __init__(self, dataset, capacity=4):
+        self._dataset = dataset
+        self._capacity = capacity
+        self._stop_event = threading.Event()
+        self._queues = {}
+        self._free_slots = {}
+        self._restored_batches = {}
+        self._threads = {}
+        self._lock = threading.Lock()
+        self._dataset_lock = threading.Lock()
+
+    def get_next_batch_with_resets(self, set_index):
+        """
+        Get next prepared batch of selected set, its reset rows mask and queue
+        reset flag. Producer of the set is started on the first call.
+        """
+        self._start_producer(set_index)
+        item = self._queues[set_index].get()
+        self._free_slots[set_index].release()
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+    def get_state(self):
+        """
+        Get state of the dataset together with batches, which are prepared,
+        but not taken yet, so that batching can be resumed right after the
+        last taken batch.
+        """
+        with self._lock, self._dataset_lock:
+            state = self._dataset.get_state()
+            pending_batches = {
+                set_index: list(batches.queue)
+                for set_index, batches in self._queues.items()
+            }
+            # Restored batches of sets, which weren't batched yet, are still
+            # waiting for their producers.
+            for set_index, batches in self._restored_batches.items():
+                pending_batches[set_index] = list(batches)
+            # Batches waiting in queues were taken from the dataset before
+            # its own restored ones.
+            for set_index, batches in state["prefetched_batches"].items():
+                pending_batches[set_index] = (
+                    pending_batches.get(set_index, []) + batches
+                )
+            state["prefetched_batches"] = pending_batches
+        return state
+
+    def set_state(self, state):
+        """
+        Restore state returned by get_state. It has to be called before any
+        batch is taken.
+        """
+        # Prefetched batches are queued by producers, not by the dataset.
+        self._dataset.set_state(dict(state, prefetched_batches={}))
+        self._restored_batches = dict(state.get("prefetched_batches", {}))
+
+    def close(self):
+        """ Stop all producers. """
+        self._stop_event.set()
+        for thread in self._threads.values():
+            thread.join()
+
+    def _start_producer(self, set_index):
+        """ Start producer thread of selected set, if it isn't running. """
+        with self._lock:
+            if set_index in self._threads:
+                return
+            batches = queue.Queue()
+            restored_batches = self._restored_batches.pop(set_index, [])
+            for item in restored_batches:
+                batches.put(item)
+            self._queues[set_index] = batches
+            self._free_slots[set_index] = threading.Semaphore(
+                max(0, self._capacity - len(restored_batches))
+            )
+            thread = threading.Thread(target=self._produce, args=[set_index],
+                                      daemon=True)
+            self._threads[set_index] = thread
+            thread.start()
+
+    def _produce(self, set_index):
+        """ Fill queue of selected set with batches until stopped. """
+        while not self._stop_event.is_set():
+            # Slot is taken before the batch is prepared, so that the batch
+            # never waits for the queue outside of it.
+            if not self._free_slots[set_index].acquire(
+                    timeout=self.STOP_CHECK_INTERVAL):
+                continue
+            with self._dataset_lock:
+                try:
+                    batch, reset_rows, queue_reset = (
+                        self._dataset.get_next_batch_with_resets(set_index)
+                    )
+                    # Dataset reuses its batch matrix, so it has to be copied.
+                    item = (batch.copy(), reset_rows, queue_reset)
+                except Exception as error:
+                    item = error
+                self._queues[set_index].put(item)
+            if isinstance(item, Exception):
+                return
@@ -0,0 +1,80 @@
+"""
+This module contains generator of synthetic tunes in the .csv row format of
+TheSession's tunes collection, used where the real dataset isn't needed.
+"""
+
+
+import csv
+
+import numpy as np
+
+from processing.data_utils import *
+
+
+__all__ = ["TUNE_TYPES", "generate_tune", "write_synthetic_csv"]
+
+
+# Tune types with their meters and number of eighth notes in a bar.
+TUNE_TYPES = {"reel": ("4/4", 8), "jig": ("6/8", 6), "polka": ("2/4", 4),
+              "slip jig": ("9/8", 9), "hornpipe": ("4/4", 8)}
+MODES = ["Dmajor", "Gmajor", "Ador", "Edorian", "Amixolydian", "Bminor"]
+PITCHES = list("CDEFGABcdefgab") + ["c'", "d'", "e'", "A,", "B,"]
+HEADER = ["tune", "setting", "name", "type", "meter", "mode", "abc", "date",
+          "username"]
+
+
+def generate_tune(random, bar_length, bars_count=16):
+    """
+    Generate abc body of a tune with bars_count bars of bar_length eighth
+    notes, split into two repeated parts with four bars in a line.
+    """
+    bars = []
+    for _ in range(bars_count):
+        bar = ""
+        remaining = bar_length
+        while remaining > 0:
+            pitch = PITCHES[random.randint(len(PITCHES))]
+            duration = min(remaining, random.choice([1, 1, 1, 2, 3]))
+            if duration == 1 and remaining >= 2 and random.rand() < 0.1:
+                # Broken rhythm takes two eighth notes.
+                bar += pitch + ">" + PITCHES[random.randint(len(PITCHES))]
+                remaining -= 2
+                continue
+            bar += pitch + ("" if duration == 1 else str(duration))
+            remaining -= duration
+        bars.append(bar)
+    lines = []
+    for part_start in range(0, bars_count, bars_count // 2):
+        part = bars[part_start:part_start + bars_count // 2]
+        part_lines = ["|".join(part[i:i + 4]) for i in range(0, len(part), 4)]
+        lines.append("|:" + "|\n".join(part_lines) + ":|")
+    return "\n".join(lines)
+
+
+def write_synthetic_csv(file_path, tunes_count=1000, seed=0):
+    """
+    Write .csv file with tunes_count synthetic tunes of random types, with
+    up to three settings each. Same seed gives the same file.
+    """
+    random = np.random.RandomState(seed)
+    tunes_types = list(TUNE_TYPES)
+    with open(file_path, "w", encoding="utf-8", newline="") as file:
+        csv_writer = csv.writer(file, escapechar="\\", doublequote=False)
+        csv_writer.writerow(HEADER)
+        for tune in range(tunes_count):
+            tune_type = tunes_types[random.randint(len(tunes_types))]
+            meter, bar_length = TUNE_TYPES[tune_type]
+            mode = MODES[random.randint(len(MODES))]
+            for setting in range(random.randint(1, 4)):
+                row = [""] * COLUMNS_COUNT
+                row[TUNE] = str(tune)
+                row[SETTING] = str(tune * 10 + setting)
+                row[NAME] = "Synthetic tune {}".format(tune)
+                row[TYPE] = tune_type
+                row[METER] = meter
+                row[MODE] = mode
+                row[ABC] = generate_tune(random, bar_length,
+                                         random.choice([8, 16, 32]))
+                row[DATE] = "2000-01-01 00:00:00"
+                row[USERNAME] = "synthetic"
+                csv_writer.writerow(row)
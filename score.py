@@ -0,0 +1,47 @@
+"""
+Entry point for scoring of tunes with the trained model. Tunes are read from
+the file given as an argument, where they are separated by blank lines, and
+log-probability, number of scored symbols and perplexity of every tune are
+printed as tab separated lines in the order of the file. First symbols of
+tunes aren't scored, because the model always predicts symbols following
+the ones it has read.
+"""
+
+
+import sys
+
+import numpy as np
+
+from model.composer import Composer
+
+
+# Number of tunes scored at once, which bounds memory usage.
+CHUNK_SIZE = 10000
+BATCH_SIZE = 256
+
+
+def main():
+    composer = Composer("data/best_model/model", "data/best_model/model.meta",
+                        "data/best_model/codec.bin")
+    with open(sys.argv[1], encoding="utf-8") as file:
+        tunes_texts = [tune_text for tune_text
+                       in file.read().split(composer.TUNE_TERMINATOR)
+                       if tune_text.strip()]
+    print("log_probability\tscored_symbols\tperplexity")
+    for chunk_start in range(0, len(tunes_texts), CHUNK_SIZE):
+        chunk = tunes_texts[chunk_start:chunk_start + CHUNK_SIZE]
+        tunes_log_probabilities, symbols_log_probabilities = composer.score(
+            chunk, BATCH_SIZE
+        )
+        for log_probability, scored_symbols in zip(
+                tunes_log_probabilities, symbols_log_probabilities):
+            scored_count = len(scored_symbols)
+            perplexity = (np.exp(-log_probability / scored_count)
+                          if scored_count > 0 else np.nan)
+            print("{:.4f}\t{}\t{:.4f}".format(log_probability, scored_count,
+                                               perplexity))
+    composer.close()
+
+
+if __name__ == "__main__":
+    main()
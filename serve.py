@@ -0,0 +1,62 @@
+"""
+Entry point for composition server. It accepts json lines over tcp, where
+{"prompt": ..., "length": ..., "terminator": ...} requests composition and
+{"metrics": true} requests scheduler metrics. Every request is answered with
+a single json line.
+"""
+
+
+import asyncio
+import json
+
+from model.numpy_composer import NumpyComposer
+from model.serving import CompositionScheduler
+
+
+HOST = "localhost"
+PORT = 8765
+
+
+async def handle_connection(scheduler, reader, writer):
+    """ Answer requests read from single connection. """
+    while True:
+        line = await reader.readline()
+        if not line:
+            break
+        try:
+            request = json.loads(line.decode("utf-8"))
+            if request.get("metrics"):
+                response = scheduler.get_metrics()
+            else:
+                tune_text = await scheduler.compose(
+                    request.get("prompt", ""), request.get("length", 300),
+                    request.get("terminator")
+                )
+                response = {"text": tune_text}
+        except Exception as error:
+            response = {"error": repr(error)}
+        writer.write((json.dumps(response) + "\n").encode("utf-8"))
+        await writer.drain()
+    writer.close()
+
+
+async def serve():
+    # Composer needs weights exported with export.py.
+    composer = NumpyComposer("data/best_model/weights.npz",
+                             "data/best_model/codec.bin")
+    scheduler = CompositionScheduler(composer, max_batch_size=64)
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(scheduler, reader, writer),
+        HOST, PORT
+    )
+    print("Serving on {}:{}".format(HOST, PORT))
+    async with server:
+        await asyncio.gather(server.serve_forever(), scheduler.run())
+
+
+def main():
+    asyncio.run(serve())
+
+
+if __name__ == "__main__":
+    main()
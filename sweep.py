@@ -0,0 +1,43 @@
+"""
+Entry point for hyperparameter sweep of the model. Trials are drawn at random
+from SEARCH_SPACE, or form its grid, if TRIALS_COUNT is None, and their
+results are saved to RESULTS_PATH.
+"""
+
+
+import json
+
+from model.sweeping import create_trials, run_sweep
+
+
+SEARCH_SPACE = {"layers_size": [128, 256, 512], "layers_count": [2, 3],
+                "lstm_dropout": (0.0, 0.6),
+                "learning_rate": [0.0005, 0.001, 0.002]}
+TRIALS_COUNT = 16
+LOGS_ROOT = "data/logs/sweep"
+RESULTS_PATH = "data/logs/sweep/results.json"
+
+
+def main():
+    roll_out = 20
+    batch_size = 100
+    dataset_params = {"file_path": "data/dataset/tunes.csv",
+                      "filtering_params": {"tune_types": ["reel"]},
+                      "batch_size": batch_size, "roll_out": roll_out,
+                      "subsets_sizes": [0.7, 0.2, 0.1],
+                      "cache_root": "data/cache"}
+    build_params = {"roll_out": roll_out, "layers_count": 3,
+                    "layers_size": 256}
+    train_params = {"early_stopping": True, "prefetch_capacity": 4}
+    results = run_sweep(create_trials(SEARCH_SPACE, TRIALS_COUNT),
+                        dataset_params, build_params, train_params, LOGS_ROOT)
+    with open(RESULTS_PATH, "w") as file:
+        json.dump(results, file, indent=2)
+    for result in sorted(results, key=lambda result: result["test_loss"]):
+        print("{params}: validation loss {validation_loss:.4f}, "
+              "test loss {test_loss:.4f}, test accuracy {test_accuracy:.4f}"
+              "{}".format(" (pruned)" if result["pruned"] else "", **result))
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,9 @@ def main():
     roll_out = 20
     batch_size = 100
     dataset = Dataset("data/dataset/tunes.csv", {"tune_types": ["reel"]},
-                      batch_size, roll_out, [0.7, 0.2, 0.1])
+                      batch_size, roll_out, [0.7, 0.2, 0.1],
+                      cache_root="data/cache", split_seed=0,
+                      deduplication={}, group_by_tune=True)
     dataset.save_encoding("data/logs/test_run_8")
     build_params = {"charset_size": dataset.get_charset_size(),
                     "roll_out": roll_out, "layers_count": 3,
@@ -20,7 +22,10 @@ def main():
         "data/logs/test_run_8/best_model"
     )
     model.train(dataset, batch_size=batch_size, lstm_dropout=0.5,
-                early_stopping=True)
+                early_stopping=True, prefetch_capacity=4, resume=True)
+    print("Train padding efficiency: {:.3f}".format(
+        dataset.get_padding_efficiency(Dataset.TRAIN)
+    ))
 
 
 if __name__ == "__main__":
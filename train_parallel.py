@@ -0,0 +1,46 @@
+"""
+Entry point for data parallel training of the model. Training on several
+nodes of one network runs this script on each of them with ADDRESS of the
+chief's node and FIRST_RANK of workers started on the node.
+"""
+
+
+from os import path
+
+from model.parallel import train_parallel
+from processing.dataset import Dataset
+
+
+ADDRESS = ("localhost", 8766)
+WORKERS_COUNT = 4
+FIRST_RANK = 0
+LOCAL_WORKERS_COUNT = 4
+
+
+def main():
+    roll_out = 20
+    batch_size = 100
+    dataset_params = {"file_path": "data/dataset/tunes.csv",
+                      "filtering_params": {"tune_types": ["reel"]},
+                      "batch_size": batch_size, "roll_out": roll_out,
+                      "subsets_sizes": [0.7, 0.2, 0.1],
+                      "cache_root": "data/cache", "split_seed": 0}
+    # Corpus is cached, so workers only memory map it after this.
+    dataset = Dataset(**dataset_params)
+    dataset.save_encoding("data/logs/parallel_run")
+    charset_size = dataset.get_charset_size()
+    build_params = {"charset_size": charset_size, "roll_out": roll_out,
+                    "layers_count": 3, "layers_size": 256}
+    roots = [path.join("data/logs/parallel_run", name) for name
+             in ["train", "validation", "checkpoints", "best_model"]]
+    train_params = {"lstm_dropout": 0.5, "early_stopping": True,
+                    "charset_size": charset_size}
+    result = train_parallel(WORKERS_COUNT, ADDRESS, dataset_params,
+                            build_params, roots, train_params, FIRST_RANK,
+                            LOCAL_WORKERS_COUNT)
+    if result is not None:
+        print("Test loss: {}, test accuracy: {}".format(*result))
+
+
+if __name__ == "__main__":
+    main()